@@ -0,0 +1,21 @@
+-- (created_at, id) keyset pagination on the listing pages
+BEGIN;
+
+-- idx_posts_created used to be (created_at DESC) only
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_indexes
+    WHERE schemaname = current_schema()
+      AND indexname = 'idx_posts_created'
+      AND indexdef NOT LIKE '%id DESC)'
+  ) THEN
+    DROP INDEX idx_posts_created;
+  END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_posts_created ON posts(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_user_created ON posts(user_id, created_at DESC, id DESC);
+
+COMMIT;
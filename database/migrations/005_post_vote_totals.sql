@@ -0,0 +1,27 @@
+-- per-post vote counters, filled from post_votes
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS post_vote_totals (
+  post_id INTEGER PRIMARY KEY REFERENCES posts(id) ON DELETE CASCADE,
+  likes INTEGER NOT NULL DEFAULT 0,
+  dislikes INTEGER NOT NULL DEFAULT 0,
+  score INTEGER GENERATED ALWAYS AS (likes - dislikes) STORED
+);
+
+-- no vote may land between the count and the write
+LOCK TABLE post_votes IN SHARE MODE;
+
+INSERT INTO post_vote_totals (post_id, likes, dislikes)
+SELECT
+  v.post_id,
+  COUNT(*) FILTER (WHERE v.value = 1),
+  COUNT(*) FILTER (WHERE v.value = -1)
+FROM post_votes v
+GROUP BY v.post_id
+ON CONFLICT (post_id) DO UPDATE
+SET likes = EXCLUDED.likes,
+    dislikes = EXCLUDED.dislikes
+WHERE (post_vote_totals.likes, post_vote_totals.dislikes)
+    IS DISTINCT FROM (EXCLUDED.likes, EXCLUDED.dislikes);
+
+COMMIT;
@@ -0,0 +1,47 @@
+-- vote_post in one round-trip, see toggle_post_vote in sql.txt
+BEGIN;
+
+CREATE OR REPLACE FUNCTION toggle_post_vote(p_post_id INTEGER, p_user_id INTEGER, p_value SMALLINT)
+RETURNS TABLE (score INTEGER, likes INTEGER, dislikes INTEGER, user_vote SMALLINT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+  old_value SMALLINT;
+  new_value SMALLINT;
+BEGIN
+  -- serializes concurrent toggles by the same voter on the same post (double clicks);
+  -- different voters only meet on the post_vote_totals row
+  PERFORM pg_advisory_xact_lock(p_post_id, p_user_id);
+
+  SELECT v.value INTO old_value
+  FROM post_votes v
+  WHERE v.post_id = p_post_id AND v.user_id = p_user_id;
+  old_value := COALESCE(old_value, 0);
+
+  IF old_value = p_value THEN
+    DELETE FROM post_votes v
+    WHERE v.post_id = p_post_id AND v.user_id = p_user_id;
+    new_value := 0;
+  ELSE
+    INSERT INTO post_votes (post_id, user_id, value)
+    VALUES (p_post_id, p_user_id, p_value)
+    ON CONFLICT (post_id, user_id)
+    DO UPDATE SET value = EXCLUDED.value, created_at = NOW();
+    new_value := p_value;
+  END IF;
+
+  RETURN QUERY
+  INSERT INTO post_vote_totals AS t (post_id, likes, dislikes)
+  VALUES (
+    p_post_id,
+    (new_value = 1)::int - (old_value = 1)::int,
+    (new_value = -1)::int - (old_value = -1)::int
+  )
+  ON CONFLICT (post_id) DO UPDATE
+  SET likes = t.likes + EXCLUDED.likes,
+      dislikes = t.dislikes + EXCLUDED.dislikes
+  RETURNING t.score, t.likes, t.dislikes, new_value;
+END
+$$;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- full-text search over title + keyword names (post_helpers.SEARCH_VECTOR_SQL)
+BEGIN;
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR;
+
+UPDATE posts p
+SET search_tsv =
+    setweight(to_tsvector('simple', p.title), 'A')
+    || setweight(to_tsvector('simple', COALESCE((
+        SELECT string_agg(k.name, ' ')
+        FROM post_keywords pk
+        JOIN keywords k ON k.id = pk.keyword_id
+        WHERE pk.post_id = p.id
+    ), '')), 'B')
+WHERE p.search_tsv IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_posts_search ON posts USING GIN (search_tsv);
+
+COMMIT;
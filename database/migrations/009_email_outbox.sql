@@ -0,0 +1,21 @@
+-- outbox drained by `flask email-worker`
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+  id BIGSERIAL PRIMARY KEY,
+  to_addr VARCHAR(100) NOT NULL,
+  subject TEXT NOT NULL,
+  body TEXT NOT NULL,
+  status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending','sent','failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  last_error TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  sent_at TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_email_outbox_unsent ON email_outbox(status) WHERE status <> 'sent';
+CREATE INDEX IF NOT EXISTS idx_email_outbox_sent ON email_outbox(sent_at) WHERE sent_at IS NOT NULL;
+
+COMMIT;
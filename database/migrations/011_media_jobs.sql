@@ -0,0 +1,22 @@
+-- background job queue and the processing state of uploaded media
+BEGIN;
+
+-- media stored before the job queue was already processed in the request: 'ready'
+ALTER TABLE post_media
+  ADD COLUMN IF NOT EXISTS status VARCHAR(12) NOT NULL DEFAULT 'ready' CHECK (status IN ('processing','ready','failed'));
+
+CREATE TABLE IF NOT EXISTS jobs (
+  id BIGSERIAL PRIMARY KEY,
+  kind VARCHAR(50) NOT NULL,
+  payload JSONB NOT NULL DEFAULT '{}',
+  status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending','running','done','failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+  last_error TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_after) WHERE status IN ('pending','running');
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- srcset renditions; existing media gets them from `flask backfill-media-variants`
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS post_media_variants (
+  post_id INTEGER NOT NULL REFERENCES post_media(post_id) ON DELETE CASCADE,
+  role VARCHAR(10) NOT NULL CHECK (role IN ('thumb','poster')),
+  width INTEGER NOT NULL,
+  height INTEGER NOT NULL,
+  file_path TEXT NOT NULL,
+  PRIMARY KEY (post_id, role, width)
+);
+
+COMMIT;
@@ -0,0 +1,52 @@
+-- content-addressed media; existing media keeps its own file (blob_sha256 NULL)
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS media_blobs (
+  sha256 CHAR(64) PRIMARY KEY,
+  file_path TEXT NOT NULL,
+  file_size_bytes BIGINT NOT NULL,
+  variants JSONB NOT NULL DEFAULT '[]',
+  ref_count INTEGER NOT NULL DEFAULT 0 CHECK (ref_count >= 0),
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  unreferenced_at TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_blobs_unreferenced ON media_blobs(unreferenced_at) WHERE ref_count = 0;
+
+CREATE TABLE IF NOT EXISTS media_source_hashes (
+  source_sha256 CHAR(64) PRIMARY KEY,
+  blob_sha256 CHAR(64) NOT NULL REFERENCES media_blobs(sha256) ON DELETE CASCADE
+);
+
+ALTER TABLE post_media ADD COLUMN IF NOT EXISTS blob_sha256 CHAR(64) NULL REFERENCES media_blobs(sha256);
+
+CREATE INDEX IF NOT EXISTS idx_post_media_blob ON post_media(blob_sha256);
+
+CREATE OR REPLACE FUNCTION post_media_blob_refs()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_sha256 IS NOT NULL THEN
+    UPDATE media_blobs
+    SET ref_count = ref_count - 1,
+        unreferenced_at = CASE WHEN ref_count = 1 THEN NOW() ELSE unreferenced_at END
+    WHERE sha256 = OLD.blob_sha256;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_sha256 IS NOT NULL THEN
+    UPDATE media_blobs
+    SET ref_count = ref_count + 1,
+        unreferenced_at = NULL
+    WHERE sha256 = NEW.blob_sha256;
+  END IF;
+
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_post_media_blob_refs ON post_media;
+CREATE TRIGGER trg_post_media_blob_refs
+AFTER INSERT OR DELETE OR UPDATE OF blob_sha256 ON post_media
+FOR EACH ROW EXECUTE FUNCTION post_media_blob_refs();
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- resumable chunked uploads
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+  id CHAR(32) PRIMARY KEY,
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  original_filename TEXT NOT NULL,
+  total_bytes BIGINT NOT NULL CHECK (total_bytes > 0),
+  received_bytes BIGINT NOT NULL DEFAULT 0,
+  kind VARCHAR(10) NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  expires_at TIMESTAMP NOT NULL DEFAULT NOW() + INTERVAL '24 hours'
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions(expires_at);
+
+COMMIT;
@@ -0,0 +1,6 @@
+-- stamp of the cached feed card (app/fragments.py)
+BEGIN;
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS card_version INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
@@ -0,0 +1,7 @@
+-- comment_helpers tree loader: page of root comments, then replies per parent
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_comments_roots ON comments(post_id, created_at, id) WHERE parent_comment_id IS NULL AND is_deleted = FALSE;
+CREATE INDEX IF NOT EXISTS idx_comments_replies ON comments(parent_comment_id, created_at, id) WHERE is_deleted = FALSE;
+
+COMMIT;
@@ -0,0 +1,55 @@
+-- posts.comment_count / last_activity_at, kept by trg_comments_activity and filled here
+BEGIN;
+
+ALTER TABLE posts
+  ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0 CHECK (comment_count >= 0),
+  ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP NOT NULL DEFAULT NOW();
+
+-- no comment may change between the count and the trigger taking over
+LOCK TABLE comments IN SHARE MODE;
+
+-- same definitions as trg_comments_activity and `flask reconcile-comment-counts`
+UPDATE posts p
+SET comment_count = c.n,
+    last_activity_at = GREATEST(p.created_at, c.latest)
+FROM (
+  SELECT p2.id,
+         COUNT(cm.id) FILTER (WHERE cm.is_deleted = FALSE) AS n,
+         MAX(cm.created_at) AS latest
+  FROM posts p2
+  LEFT JOIN comments cm ON cm.post_id = p2.id
+  GROUP BY p2.id
+) c
+WHERE p.id = c.id
+  AND (p.comment_count, p.last_activity_at)
+      IS DISTINCT FROM (c.n, GREATEST(p.created_at, c.latest));
+
+CREATE INDEX IF NOT EXISTS idx_posts_activity ON posts(last_activity_at DESC, id DESC) WHERE is_deleted = FALSE;
+
+CREATE OR REPLACE FUNCTION comments_activity()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND NOT OLD.is_deleted THEN
+    UPDATE posts
+    SET comment_count = comment_count - 1
+    WHERE id = OLD.post_id;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NOT NEW.is_deleted THEN
+    UPDATE posts
+    SET comment_count = comment_count + 1,
+        last_activity_at = GREATEST(last_activity_at, NEW.created_at)
+    WHERE id = NEW.post_id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_comments_activity ON comments;
+CREATE TRIGGER trg_comments_activity
+AFTER INSERT OR DELETE OR UPDATE OF is_deleted ON comments
+FOR EACH ROW EXECUTE FUNCTION comments_activity();
+
+COMMIT;
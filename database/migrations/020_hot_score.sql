@@ -0,0 +1,27 @@
+-- /feed?sort=hot: posts.hot_score, filled here and then kept by the refresh_hot_scores job
+BEGIN;
+
+CREATE OR REPLACE FUNCTION post_hot_score(p_score INTEGER, p_created_at TIMESTAMP)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT sign(p_score::float8) * log(greatest(abs(p_score), 1)::float8)
+    + (extract(epoch FROM p_created_at)::float8 - 1134028003) / 45000
+$$;
+
+ALTER TABLE posts
+  ADD COLUMN IF NOT EXISTS hot_score DOUBLE PRECISION NOT NULL DEFAULT post_hot_score(0, LOCALTIMESTAMP);
+
+-- every post, not just the refresh window: the column default ranks old posts as new
+UPDATE posts p
+SET hot_score = h.hot_score
+FROM (
+  SELECT p2.id, post_hot_score(COALESCE(t.score, 0), p2.created_at) AS hot_score
+  FROM posts p2
+  LEFT JOIN post_vote_totals t ON t.post_id = p2.id
+) h
+WHERE p.id = h.id
+  AND p.hot_score IS DISTINCT FROM h.hot_score;
+
+CREATE INDEX IF NOT EXISTS idx_posts_hot ON posts(hot_score DESC, created_at DESC, id DESC) WHERE is_deleted = FALSE;
+
+COMMIT;
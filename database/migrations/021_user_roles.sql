@@ -0,0 +1,24 @@
+-- users.role and the admin dashboard search indexes
+BEGIN;
+
+-- a database without the column takes its admins from is_admin, once
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'users' AND column_name = 'role'
+  ) THEN
+    ALTER TABLE users
+      ADD COLUMN role VARCHAR(20) NOT NULL DEFAULT 'user' CHECK (role IN ('user','moderator','admin'));
+    UPDATE users SET role = 'admin' WHERE is_admin = TRUE;
+  END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_prefix ON users (lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users (role, id);
+CREATE INDEX IF NOT EXISTS idx_users_blocked ON users (id) WHERE is_blocked = TRUE;
+CREATE INDEX IF NOT EXISTS idx_users_inactive ON users (id) WHERE is_activated = FALSE;
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- cascading bans: content hidden by a ban is marked so an unban restores exactly that
+BEGIN;
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS deleted_by_ban BOOLEAN NOT NULL DEFAULT FALSE;
+
+ALTER TABLE comments
+  ADD COLUMN IF NOT EXISTS deleted_by_user_id INTEGER NULL REFERENCES users(id),
+  ADD COLUMN IF NOT EXISTS deleted_by_ban BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_posts_banned ON posts(user_id) WHERE deleted_by_ban = TRUE;
+CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(user_id);
+CREATE INDEX IF NOT EXISTS idx_comments_banned ON comments(user_id) WHERE deleted_by_ban = TRUE;
+
+COMMIT;
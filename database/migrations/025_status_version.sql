@@ -0,0 +1,6 @@
+-- version of the role / ban state cached by security.get_user_status
+BEGIN;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS status_version INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
@@ -6,12 +6,21 @@ from .admin.routes import admin_bp
 from .posts.routes import posts_bp
 from .users.routes import users_bp
 from app.context_processors import inject_permissions
+from app import db, cli, fragments, page_cache, rate_limit
+from app.uploads import UploadRequest
 import os
 
 def create_app():
     app = Flask(__name__)
+    app.request_class = UploadRequest
     app.config.from_object(Config)
 
+    db.init_app(app)
+    cli.init_app(app)
+    fragments.init_app(app)
+    page_cache.init_app(app)
+    rate_limit.init_app(app)
+
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp)
@@ -22,5 +31,7 @@ def create_app():
 
     app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "..", "uploads")
     os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    app.config["QUARANTINE_FOLDER"] = os.path.join(app.root_path, "..", "quarantine")
+    os.makedirs(app.config["QUARANTINE_FOLDER"], exist_ok=True)
 
     return app
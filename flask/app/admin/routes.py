@@ -1,41 +1,56 @@
 from flask import Blueprint
-from flask import render_template, request, redirect, url_for, session, abort, jsonify
+from flask import render_template, request, redirect, url_for, session, abort, jsonify, current_app
 from app.decorators import roles_required, permission_required
-from app.db import get_db_connection
-from app.security import is_safe_redirect
+from app.db import get_db
+from app.security import is_safe_redirect, invalidate_user_permissions, set_user_status
+from app.email import outbox_metrics
+from app.fragments import card_cache, invalidate_card
+from app.page_cache import page_cache
+from app.rate_limit import limiter
+from app.admin_helpers import search_users, ROLES, USER_STATUSES
+from app.admin_helpers import USER_STATUS_ACTIONS, bulk_set_user_status, bulk_set_user_role
+from app.admin_helpers import bulk_set_user_permissions, bulk_set_posts_deleted, cascade_ban
 
 admin_bp = Blueprint("admin", __name__)
 
+def _user_filters():
+    return {
+        "q": (request.args.get("q") or "").strip(),
+        "role": (request.args.get("role") or "").strip(),
+        "status": (request.args.get("status") or "").strip(),
+    }
+
+def _users_url(endpoint, filters, after):
+    if not after:
+        return None
+    return url_for(endpoint, after=after, **{k: v for k, v in filters.items() if v})
+
 @admin_bp.route("/admin", methods=["GET"])
 @roles_required("admin")
 def dashboard():
-    conn = get_db_connection()
-    cur = conn.cursor() 
-    cur.execute("""
-        SELECT
-            u.id,
-            u.username,
-            u.email,
-            u.role,
-            u.is_activated,
-            u.is_blocked,
-            COALESCE(
-                string_agg(up.permission_key, ',' ORDER BY up.permission_key),
-                ''
-            ) AS permissions
-        FROM users u
-        LEFT JOIN user_permissions up
-            ON up.user_id = u.id
-        GROUP BY
-            u.id, u.username, u.email, u.role, u.is_activated, u.is_blocked
-        ORDER BY u.id;
-    """)
-    users = cur.fetchall()
-
-    cur.close()
-    conn.close()
+    filters = _user_filters()
+    users, next_after = search_users(after=request.args.get("after", type=int), **filters)
+
+    return render_template(
+        "admin_dashboard.html",
+        users=users,
+        filters=filters,
+        roles=ROLES,
+        statuses=USER_STATUSES,
+        more_url=_users_url("admin.users_json", filters, next_after),
+    )
+
+@admin_bp.route("/admin/users.json", methods=["GET"])
+@roles_required("admin")
+def users_json():
+    """Next page of dashboard rows for "Load more", with the same filters as /admin."""
+    filters = _user_filters()
+    users, next_after = search_users(after=request.args.get("after", type=int), **filters)
 
-    return render_template("admin_dashboard.html", users=users)
+    return jsonify({
+        "html": render_template("_admin_user_rows.html", users=users),
+        "next": _users_url("admin.users_json", filters, next_after),
+    })
 
 @admin_bp.route("/admin/users/<int:user_id>/toggle", methods=["POST"])
 @permission_required("ban_user")
@@ -43,8 +58,7 @@ def toggle_user_status(user_id):
     if user_id == session.get("user_id"):
         abort(400)
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("""
         SELECT is_activated, is_blocked
@@ -61,29 +75,40 @@ def toggle_user_status(user_id):
     if is_blocked:
         cur.execute("""
             UPDATE users
-            SET is_blocked = FALSE
+            SET is_blocked = FALSE,
+                status_version = status_version + 1
             WHERE id = %s
+            RETURNING role, is_blocked, is_activated, status_version
         """, (user_id, ))
+        set_user_status(user_id, *cur.fetchone())
+        # brings back whatever a cascading ban hid; a no-op otherwise
+        cascade_ban(cur, [user_id], hide=False, actor_id=session["user_id"])
     
     elif not is_blocked and is_activated:
         cur.execute("""
             UPDATE users
-            SET is_blocked = TRUE
+            SET is_blocked = TRUE,
+                status_version = status_version + 1
             WHERE id = %s
+            RETURNING role, is_blocked, is_activated, status_version
         """, (user_id, ))
+        set_user_status(user_id, *cur.fetchone())
+        if request.form.get("cascade"):
+            cascade_ban(cur, [user_id], hide=True, actor_id=session["user_id"])
     
     elif not is_activated:
         cur.execute("""
             UPDATE users
             SET is_activated = TRUE,
                 activation_token = NULL,
-                activation_token_expiry = NULL
+                activation_token_expiry = NULL,
+                status_version = status_version + 1
             WHERE id = %s
+            RETURNING role, is_blocked, is_activated, status_version
         """, (user_id, ))
+        set_user_status(user_id, *cur.fetchone())
     
-    conn.commit()
     cur.close()
-    conn.close()
 
     next_url = request.form.get("next") or request.args.get("next")
     if is_safe_redirect(next_url):
@@ -94,13 +119,10 @@ def toggle_user_status(user_id):
 @admin_bp.route("/admin/users/<int:user_id>/permissions", methods=["GET"])
 @roles_required("admin")
 def get_user_permissions(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("SELECT 1 FROM users WHERE id=%s", (user_id,))
     if cur.fetchone() is None:
-        cur.close()
-        conn.close()
         abort(404)
 
     cur.execute("SELECT key, description FROM permissions ORDER BY key")
@@ -110,7 +132,6 @@ def get_user_permissions(user_id):
     assigned = [r[0] for r in cur.fetchall()]
 
     cur.close()
-    conn.close()
 
     return jsonify({
         "all": [{"key": k, "description": d} for (k, d) in all_perms],
@@ -131,15 +152,12 @@ def set_user_permissions(user_id):
 
     perms = sorted(set([p.strip() for p in perms if isinstance(p, str) and p.strip()]))
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     if perms:
         cur.execute("SELECT key FROM permissions WHERE key = ANY(%s)", (perms,))
         valid = {r[0] for r in cur.fetchall()}
         if len(valid) != len(perms):
-            cur.close()
-            conn.close()
             abort(400)
 
     cur.execute("DELETE FROM user_permissions WHERE user_id=%s", (user_id,))
@@ -149,9 +167,8 @@ def set_user_permissions(user_id):
             [(user_id, p) for p in perms]
         )
 
-    conn.commit()
     cur.close()
-    conn.close()
+    invalidate_user_permissions(user_id)
 
     return jsonify({"success": True})
 
@@ -168,17 +185,156 @@ def set_user_role(user_id):
     if new_role not in allowed:
         abort(400)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
-    cur.execute("UPDATE users SET role=%s WHERE id=%s", (new_role, user_id))
+    cur.execute("""
+        UPDATE users
+        SET role = %s,
+            status_version = status_version + 1
+        WHERE id = %s
+        RETURNING role, is_blocked, is_activated, status_version
+    """, (new_role, user_id))
+    row = cur.fetchone()
+    if row is None:
+        cur.close()
+        abort(404)
+    set_user_status(user_id, *row)
 
     # delte permissions if changed to user
     if new_role == "user":
         cur.execute("DELETE FROM user_permissions WHERE user_id=%s", (user_id,))
 
-    conn.commit()
     cur.close()
-    conn.close()
+    invalidate_user_permissions(user_id)
+
+    return jsonify({"success": True, "role": new_role})
+
+def _bulk_ids(data, key):
+    """Distinct integer ids from data[key], in request order; 400 unless 1..BULK_MAX_ITEMS of them."""
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids:
+        abort(400)
+    if any(not isinstance(i, int) or isinstance(i, bool) for i in ids):
+        abort(400)
+
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > current_app.config["BULK_MAX_ITEMS"]:
+        abort(400)
+    return ids
+
+def _without_self(ids):
+    # like the single-user routes, admins cannot change their own account
+    self_id = session.get("user_id")
+    return [i for i in ids if i != self_id], {self_id: "forbidden"} if self_id in ids else {}
+
+@admin_bp.route("/admin/users/bulk/status", methods=["POST"])
+@permission_required("ban_user")
+def bulk_user_status():
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    if action not in USER_STATUS_ACTIONS:
+        abort(400)
+
+    ids, results = _without_self(_bulk_ids(data, "user_ids"))
+    response = {"action": action, "results": results}
+
+    cur = get_db().cursor()
+    if ids:
+        results.update(bulk_set_user_status(cur, ids, action))
+
+        # "cascade": true on block also hides the users' posts and comments; unblock restores them
+        changed = [i for i in ids if results[i] == "ok"]
+        if action == "unblock":
+            response["content"] = cascade_ban(cur, changed, hide=False, actor_id=session["user_id"])
+        elif action == "block" and data.get("cascade") is True:
+            response["content"] = cascade_ban(cur, changed, hide=True, actor_id=session["user_id"])
+    cur.close()
+
+    return jsonify(response)
+
+@admin_bp.route("/admin/users/bulk/role", methods=["POST"])
+@roles_required("admin")
+def bulk_user_role():
+    data = request.get_json(silent=True) or {}
+    role = (data.get("role") or "").strip()
+    if role not in ROLES:
+        abort(400)
+
+    ids, results = _without_self(_bulk_ids(data, "user_ids"))
+
+    cur = get_db().cursor()
+    if ids:
+        results.update(bulk_set_user_role(cur, ids, role))
+    cur.close()
 
-    return jsonify({"success": True, "role": new_role})
\ No newline at end of file
+    for user_id in ids:
+        invalidate_user_permissions(user_id)
+
+    return jsonify({"role": role, "results": results})
+
+@admin_bp.route("/admin/users/bulk/permissions", methods=["POST"])
+@roles_required("admin")
+def bulk_user_permissions():
+    data = request.get_json(silent=True) or {}
+    perms = data.get("permissions", [])
+    if not isinstance(perms, list):
+        abort(400)
+
+    perms = sorted(set([p.strip() for p in perms if isinstance(p, str) and p.strip()]))
+    ids, results = _without_self(_bulk_ids(data, "user_ids"))
+
+    cur = get_db().cursor()
+
+    if perms:
+        cur.execute("SELECT key FROM permissions WHERE key = ANY(%s)", (perms,))
+        valid = {r[0] for r in cur.fetchall()}
+        if len(valid) != len(perms):
+            abort(400)
+
+    if ids:
+        results.update(bulk_set_user_permissions(cur, ids, perms))
+    cur.close()
+
+    for user_id in ids:
+        invalidate_user_permissions(user_id)
+
+    return jsonify({"permissions": perms, "results": results})
+
+@admin_bp.route("/admin/posts/bulk", methods=["POST"])
+@permission_required("delete_any_post")
+def bulk_posts():
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    if action not in ("delete", "recover"):
+        abort(400)
+
+    ids = _bulk_ids(data, "post_ids")
+
+    cur = get_db().cursor()
+    results = bulk_set_posts_deleted(cur, ids, action == "delete", session["user_id"])
+    cur.close()
+
+    for post_id, result in results.items():
+        if result == "ok":
+            invalidate_card(post_id)
+
+    return jsonify({"action": action, "results": results})
+
+@admin_bp.route("/admin/email/metrics", methods=["GET"])
+@roles_required("admin")
+def email_metrics():
+    cur = get_db().cursor()
+    metrics = outbox_metrics(cur)
+    cur.close()
+
+    return jsonify(metrics)
+
+@admin_bp.route("/admin/cache/metrics", methods=["GET"])
+@roles_required("admin")
+def cache_metrics():
+    # per process: each worker has its own caches
+    return jsonify({
+        "feed_cards": card_cache.stats(),
+        "anonymous_pages": page_cache.stats(),
+        "rate_limits": limiter.stats(),
+    })
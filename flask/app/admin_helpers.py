@@ -0,0 +1,268 @@
+import json
+
+from flask import current_app
+
+from app.db import get_db
+from app.jobs import enqueue_job, register_job
+from app.security import set_user_status
+
+ADMIN_PAGE_SIZE = 50
+
+ROLES = ("user", "moderator", "admin")
+
+# ?status= filter -> condition; each has a matching partial index in sql.txt where selective
+USER_STATUSES = {
+    "blocked": "u.is_blocked = TRUE",
+    "active": "u.is_activated = TRUE AND u.is_blocked = FALSE",
+    "inactive": "u.is_activated = FALSE",
+}
+
+
+def _like_prefix(q: str) -> str:
+    escaped = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def search_users(q="", role="", status="", after=None, limit=ADMIN_PAGE_SIZE):
+    """
+    One page of the admin user table, ordered by id. `q` is a case-insensitive prefix of the
+    username or email (idx_users_username_prefix / idx_users_email_prefix); `role` and
+    `status` are exact filters. `after` is the last user id of the previous page.
+    Returns (rows, next_after); rows are (id, username, email, role, is_activated, is_blocked, permissions).
+    """
+    where = ["TRUE"]
+    params = []
+
+    if q:
+        where.append("(lower(u.username) LIKE %s OR lower(u.email) LIKE %s)")
+        params += [_like_prefix(q)] * 2
+    if role in ROLES:
+        where.append("u.role = %s")
+        params.append(role)
+    if status in USER_STATUSES:
+        where.append(USER_STATUSES[status])
+    if after:
+        where.append("u.id > %s")
+        params.append(after)
+
+    cur = get_db().cursor()
+    # permissions are aggregated per row of the page only, never over the whole table
+    cur.execute(f"""
+        SELECT
+            u.id,
+            u.username,
+            u.email,
+            u.role,
+            u.is_activated,
+            u.is_blocked,
+            COALESCE((
+                SELECT string_agg(up.permission_key, ',' ORDER BY up.permission_key)
+                FROM user_permissions up
+                WHERE up.user_id = u.id
+            ), '') AS permissions
+        FROM users u
+        WHERE {" AND ".join(where)}
+        ORDER BY u.id
+        LIMIT %s
+    """, (*params, limit + 1))
+    rows = cur.fetchall()
+    cur.close()
+
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][0]
+    return rows, next_after
+
+
+# bulk moderation: each action is one set-based UPDATE over the given ids. The result maps
+# every requested id to "ok" (changed), "unchanged" (already in that state) or "not_found".
+
+# action -> (SET clause, rows it applies to)
+USER_STATUS_ACTIONS = {
+    "block": ("is_blocked = TRUE", "is_activated = TRUE AND is_blocked = FALSE"),
+    "unblock": ("is_blocked = FALSE", "is_blocked = TRUE"),
+    "activate": (
+        "is_activated = TRUE, activation_token = NULL, activation_token_expiry = NULL",
+        "is_activated = FALSE",
+    ),
+}
+
+
+def _record_statuses(cur):
+    # rows of UPDATE users ... RETURNING id, role, is_blocked, is_activated, status_version
+    changed = []
+    for user_id, *status in cur.fetchall():
+        set_user_status(user_id, *status)
+        changed.append(user_id)
+    return changed
+
+
+def _bulk_results(cur, table, ids, changed):
+    changed = set(changed)
+    cur.execute(f"SELECT id FROM {table} WHERE id = ANY(%s)", (list(ids),))
+    existing = {r[0] for r in cur.fetchall()}
+    return {
+        i: "not_found" if i not in existing else "ok" if i in changed else "unchanged"
+        for i in ids
+    }
+
+
+def bulk_set_user_status(cur, user_ids, action):
+    set_sql, where_sql = USER_STATUS_ACTIONS[action]
+    cur.execute(f"""
+        UPDATE users
+        SET {set_sql}, status_version = status_version + 1
+        WHERE id = ANY(%s) AND {where_sql}
+        RETURNING id, role, is_blocked, is_activated, status_version
+    """, (list(user_ids),))
+    return _bulk_results(cur, "users", user_ids, _record_statuses(cur))
+
+
+def bulk_set_user_role(cur, user_ids, role):
+    cur.execute("""
+        UPDATE users
+        SET role = %s, status_version = status_version + 1
+        WHERE id = ANY(%s) AND role <> %s
+        RETURNING id, role, is_blocked, is_activated, status_version
+    """, (role, list(user_ids), role))
+    changed = _record_statuses(cur)
+
+    # same rule as set_user_role: plain users keep no permissions
+    if role == "user":
+        cur.execute("DELETE FROM user_permissions WHERE user_id = ANY(%s)", (list(user_ids),))
+    return _bulk_results(cur, "users", user_ids, changed)
+
+
+def bulk_set_user_permissions(cur, user_ids, permissions):
+    """Replaces the permission set of every user; `permissions` must already be validated."""
+    cur.execute("""
+        DELETE FROM user_permissions
+        WHERE user_id = ANY(%s)
+        RETURNING user_id, permission_key
+    """, (list(user_ids),))
+    before = {}
+    for user_id, key in cur.fetchall():
+        before.setdefault(user_id, set()).add(key)
+
+    cur.execute("""
+        INSERT INTO user_permissions (user_id, permission_key)
+        SELECT u.id, k.key
+        FROM users u
+        CROSS JOIN unnest(%s::varchar[]) AS k(key)
+        WHERE u.id = ANY(%s)
+    """, (list(permissions), list(user_ids)))
+
+    wanted = set(permissions)
+    changed = [i for i in user_ids if before.get(i, set()) != wanted]
+    return _bulk_results(cur, "users", user_ids, changed)
+
+
+def bulk_set_posts_deleted(cur, post_ids, deleted: bool, actor_id: int):
+    """Soft-deletes (or recovers) posts, recording the moderator like delete_post does."""
+    cur.execute("""
+        UPDATE posts
+        SET is_deleted = %s,
+            deleted_at = NOW(),
+            deleted_by_user_id = %s,
+            deleted_by_ban = FALSE,
+            card_version = card_version + 1
+        WHERE id = ANY(%s) AND is_deleted <> %s
+        RETURNING id
+    """, (deleted, actor_id, list(post_ids), deleted))
+    return _bulk_results(cur, "posts", post_ids, [r[0] for r in cur.fetchall()])
+
+
+# cascading ban: hide everything a banned user posted, and bring back exactly that on unban.
+# Rows hidden this way carry deleted_by_ban, so content deleted for other reasons stays deleted.
+
+# (table, rows to change, SET clause) for hide=True / hide=False
+_CASCADE_SQL = {
+    True: (
+        ("posts", "user_id = ANY(%(users)s) AND is_deleted = FALSE",
+         "is_deleted = TRUE, deleted_at = NOW(), deleted_by_user_id = %(actor)s, deleted_by_ban = TRUE, "
+         "card_version = card_version + 1"),
+        ("comments", "user_id = ANY(%(users)s) AND is_deleted = FALSE",
+         "is_deleted = TRUE, deleted_by_user_id = %(actor)s, deleted_by_ban = TRUE"),
+    ),
+    False: (
+        ("posts", "user_id = ANY(%(users)s) AND deleted_by_ban = TRUE",
+         "is_deleted = FALSE, deleted_at = NOW(), deleted_by_user_id = %(actor)s, deleted_by_ban = FALSE, "
+         "card_version = card_version + 1"),
+        ("comments", "user_id = ANY(%(users)s) AND deleted_by_ban = TRUE",
+         "is_deleted = FALSE, deleted_by_user_id = NULL, deleted_by_ban = FALSE"),
+    ),
+}
+
+CASCADE_JOB = "ban_cascade"
+
+
+def set_user_content_hidden(cur, user_ids, hide: bool, actor_id: int, limit=None) -> int:
+    """
+    Hides (or restores) the posts and comments of user_ids with one UPDATE per table;
+    with `limit`, changes at most that many rows per table. Returns the rows changed.
+    """
+    params = {"users": list(user_ids), "actor": actor_id, "limit": limit}
+    changed = 0
+    for table, where_sql, set_sql in _CASCADE_SQL[hide]:
+        if limit:
+            where_sql = f"id IN (SELECT id FROM {table} WHERE {where_sql} LIMIT %(limit)s)"
+        cur.execute(f"UPDATE {table} SET {set_sql} WHERE {where_sql}", params)
+        changed += cur.rowcount
+    return changed
+
+
+def _count_user_content(cur, user_ids, hide: bool, cap: int) -> int:
+    # counts at most cap + 1 rows per table: enough to choose between inline and queued
+    total = 0
+    for table, where_sql, _set_sql in _CASCADE_SQL[hide]:
+        cur.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {where_sql} LIMIT %(cap)s) t",
+                    {"users": list(user_ids), "cap": cap + 1})
+        total += cur.fetchone()[0]
+    return total
+
+
+def cascade_ban(cur, user_ids, hide: bool, actor_id: int) -> str:
+    """
+    Hides (hide=True, after a ban) or restores (after an unban) the users' content.
+    Up to BAN_CASCADE_SYNC_LIMIT rows change inside the current request transaction ("done");
+    larger histories go to a ban_cascade job that works through them in batches ("queued").
+    """
+    if not user_ids:
+        return "done"
+
+    sync_limit = current_app.config["BAN_CASCADE_SYNC_LIMIT"]
+    if _count_user_content(cur, user_ids, hide, sync_limit) <= sync_limit:
+        set_user_content_hidden(cur, user_ids, hide, actor_id)
+        return "done"
+
+    enqueue_job(CASCADE_JOB, {
+        "user_ids": list(user_ids),
+        "hide": hide,
+        "actor_id": actor_id,
+        "batch": current_app.config["BAN_CASCADE_BATCH"],
+    })
+    return "queued"
+
+
+def _run_cascade(payload):
+    # database-only work, done in _finish_cascade
+    return None
+
+
+def _finish_cascade(cur, payload, _result):
+    # a ban lifted (or reinstated) since the job was queued wins over the job
+    cur.execute("SELECT id FROM users WHERE id = ANY(%s) AND is_blocked = %s",
+                (payload["user_ids"], payload["hide"]))
+    user_ids = [r[0] for r in cur.fetchall()]
+    if not user_ids:
+        return
+
+    changed = set_user_content_hidden(cur, user_ids, payload["hide"], payload["actor_id"], payload["batch"])
+    if changed:
+        # more may be left: continue in a fresh transaction
+        cur.execute("INSERT INTO jobs (kind, payload) VALUES (%s, %s)",
+                    (CASCADE_JOB, json.dumps(dict(payload, user_ids=user_ids))))
+
+
+register_job(CASCADE_JOB, _run_cascade, _finish_cascade)
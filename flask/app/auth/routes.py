@@ -1,9 +1,10 @@
 from flask import Blueprint
 from flask import render_template, request, redirect, url_for, session
-from app.db import get_db_connection
-from app.security import hash_password, check_password, is_valid_email, is_valid_password, is_valid_username
+from app.db import get_db
+from app.security import hash_password, check_password, password_needs_rehash, is_valid_email, is_valid_password, is_valid_username
 import secrets
 from app.email import send_reset_email, send_token
+from app.rate_limit import rate_limited
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -14,6 +15,7 @@ def login_get():
     return render_template("login.html")
 
 @auth_bp.route("/login", methods=["POST"])
+@rate_limited("login", field="username")
 def login_post():
     username = request.form["username"]
     password = request.form["password"]
@@ -22,8 +24,7 @@ def login_post():
     username_pattern = r'^[A-Za-z0-9_]{3,}$'
 
     if is_valid_email(username) or is_valid_username(username):
-        conn = get_db_connection()
-        cur = conn.cursor()
+        cur = get_db().cursor()
     
         cur.execute("""
                 SELECT password_hash, is_activated, email, activation_token, id, username, role, is_blocked
@@ -33,7 +34,6 @@ def login_post():
         user = cur.fetchone()
 
         cur.close()
-        conn.close()
     else:
         return render_template("login.html", error="Invalid username or password")
     
@@ -46,6 +46,12 @@ def login_post():
         if user[7]:  # is_blocked is TRUE
             return render_template("login.html",
                                 error="You have been banned from the site.")
+
+        if password_needs_rehash(user[0]):  # BCRYPT_ROUNDS changed since this hash was made
+            cur = get_db().cursor()
+            cur.execute("UPDATE users SET password_hash = %s WHERE id = %s",
+                        (hash_password(password), user[4]))
+            cur.close()
         
         session.clear()
         session.modified = True
@@ -69,6 +75,7 @@ def register_get():
     return render_template("register.html")
 
 @auth_bp.route("/register", methods=["POST"])
+@rate_limited("register", field="email")
 def register_post():
     username = request.form["username"]
     email = request.form["email"]
@@ -80,14 +87,12 @@ def register_post():
     
     if is_valid_username(username):
         
-        conn = get_db_connection()
-        cur = conn.cursor()
+        cur = get_db().cursor()
     
         cur.execute("SELECT * FROM users WHERE username = %s OR email = %s", (username, email))
         user = cur.fetchone()
     
         cur.close()
-        conn.close()
     else:
         return render_template("register.html", error="Passwords must contain at least 1 upper case letter,"
                                                       "1 special character and be at least 8 characters long."
@@ -100,8 +105,7 @@ def register_post():
                 
                 hashed = hash_password(password)
     
-                conn = get_db_connection()
-                cur = conn.cursor()
+                cur = get_db().cursor()
                 
                 token, expiry = send_token(email)
                 
@@ -110,9 +114,7 @@ def register_post():
                     activation_token, activation_token_expiry) VALUES (%s, %s, %s, %s, %s)""",
                     (username, email, hashed, token, expiry)
                 )
-                conn.commit()
                 cur.close()
-                conn.close()
                 return "Registration successful! Please activate your account."
             else:
                 return render_template("register.html", error="Passwords must contain at least 1 upper case letter,"
@@ -127,30 +129,28 @@ def register_post():
 def activate():
     token = request.args.get("token")
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("""
         UPDATE users
-        SET is_activated = TRUE, activation_token = NULL, activation_token_expiry = NULL
+        SET is_activated = TRUE, activation_token = NULL, activation_token_expiry = NULL,
+            status_version = status_version + 1
         WHERE activation_token = %s
           AND activation_token_expiry > NOW()
         RETURNING id
     """, (token,))
 
     result = cur.fetchone()
-    conn.commit()
     cur.close()
-    conn.close()
 
     return "Activation successful!" if result else "Invalid or expired token."
 
 @auth_bp.route("/resend_activation")
+@rate_limited("resend_activation", field="email", methods=("GET",))
 def resend_activation():
     email = request.args.get("email")
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
     
     token, expiry = send_token(email)
     
@@ -159,9 +159,7 @@ def resend_activation():
         WHERE email = %s
     """, (token, expiry, email))
     
-    conn.commit()
     cur.close()
-    conn.close()
     
     return "A new activation email has been sent."
 
@@ -172,12 +170,12 @@ def logout():
     return redirect(url_for("main.index"))
 
 @auth_bp.route("/forgot-password", methods=["GET", "POST"])
+@rate_limited("forgot_password", field="email")
 def forgot_password():
     if request.method == "POST":
         email = request.form["email"]
 
-        conn = get_db_connection()
-        cur = conn.cursor()
+        cur = get_db().cursor()
 
         cur.execute("SELECT id FROM users WHERE email=%s AND is_activated=TRUE", (email,))
         user = cur.fetchone()
@@ -190,12 +188,10 @@ def forgot_password():
                 SET reset_token=%s, reset_token_expiry=NOW() + INTERVAL '1 hour'
                 WHERE email=%s
             """, (token, email))
-            conn.commit()
 
             send_reset_email(email, token)
 
         cur.close()
-        conn.close()
 
         return render_template("forgot_password.html", message="If the email exists, a reset link was sent.")
 
@@ -204,8 +200,7 @@ def forgot_password():
 
 @auth_bp.route("/reset-password/<token>", methods=["GET", "POST"])
 def reset_password(token):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("""
         SELECT id 
@@ -239,13 +234,10 @@ def reset_password(token):
             SET password_hash=%s, reset_token=NULL, reset_token_expiry=NULL
             WHERE id=%s
         """, (hashed, user[0]))
-        conn.commit()
         cur.close()
-        conn.close()
 
         return redirect(url_for("auth.login_get"))
 
     cur.close()
-    conn.close()
     return render_template("reset_password.html", token=token)
 
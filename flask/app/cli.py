@@ -0,0 +1,478 @@
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+
+import click
+import psycopg2
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.db import get_db_connection, dsn_from_config
+from app.email import OutboxWorker
+from app.jobs import JobWorker
+from app.post_helpers import SEARCH_VECTOR_SQL, explain_search, feed_plan_problems, plan_nodes
+from app.ranking import refresh_hot_scores, schedule_refresh
+
+
+def init_app(app):
+    app.cli.add_command(reconcile_vote_totals)
+    app.cli.add_command(reconcile_comment_counts)
+    app.cli.add_command(bench_votes)
+    app.cli.add_command(reindex_search)
+    app.cli.add_command(refresh_hot_scores_command)
+    app.cli.add_command(check_feed_plan)
+    app.cli.add_command(email_worker)
+    app.cli.add_command(jobs_worker)
+    app.cli.add_command(backfill_media_variants)
+    app.cli.add_command(gc_media)
+
+
+@click.command("reconcile-vote-totals")
+@with_appcontext
+@click.option("--batch-size", default=5000, show_default=True, help="Posts per transaction.")
+def reconcile_vote_totals(batch_size):
+    """Backfill post_vote_totals from post_votes and repair any drift."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM posts")
+    max_id = cur.fetchone()[0]
+
+    fixed = 0
+    for lo in range(0, max_id + 1, batch_size):
+        hi = lo + batch_size
+
+        # hold the existing counter rows so votes landing mid-batch wait for us
+        cur.execute("""
+            SELECT post_id FROM post_vote_totals
+            WHERE post_id >= %s AND post_id < %s
+            FOR UPDATE
+        """, (lo, hi))
+
+        cur.execute("""
+            INSERT INTO post_vote_totals (post_id, likes, dislikes)
+            SELECT
+                p.id,
+                COUNT(v.value) FILTER (WHERE v.value = 1),
+                COUNT(v.value) FILTER (WHERE v.value = -1)
+            FROM posts p
+            LEFT JOIN post_votes v ON v.post_id = p.id
+            WHERE p.id >= %s AND p.id < %s
+            GROUP BY p.id
+            ON CONFLICT (post_id) DO UPDATE
+            SET likes = EXCLUDED.likes,
+                dislikes = EXCLUDED.dislikes
+            WHERE (post_vote_totals.likes, post_vote_totals.dislikes)
+                IS DISTINCT FROM (EXCLUDED.likes, EXCLUDED.dislikes)
+        """, (lo, hi))
+        fixed += cur.rowcount
+        conn.commit()
+
+    cur.close()
+    conn.close()
+    click.echo(f"post_vote_totals: {fixed} row(s) inserted or corrected")
+
+
+@click.command("reconcile-comment-counts")
+@with_appcontext
+@click.option("--batch-size", default=5000, show_default=True, help="Posts per transaction.")
+def reconcile_comment_counts(batch_size):
+    """
+    Backfill posts.comment_count / last_activity_at from comments and repair any drift.
+    Same definitions as trg_comments_activity: the count covers comments that are not
+    soft-deleted, the activity time every comment ever posted (deleting one keeps it).
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM posts")
+    max_id = cur.fetchone()[0]
+
+    fixed = 0
+    for lo in range(0, max_id + 1, batch_size):
+        # the row locks taken by UPDATE make comments landing mid-batch wait for us
+        cur.execute("""
+            UPDATE posts p
+            SET comment_count = c.n,
+                last_activity_at = GREATEST(p.created_at, c.latest)
+            FROM (
+                SELECT p2.id,
+                       COUNT(cm.id) FILTER (WHERE cm.is_deleted = FALSE) AS n,
+                       MAX(cm.created_at) AS latest
+                FROM posts p2
+                LEFT JOIN comments cm ON cm.post_id = p2.id
+                WHERE p2.id >= %s AND p2.id < %s
+                GROUP BY p2.id
+            ) c
+            WHERE p.id = c.id
+                AND (p.comment_count, p.last_activity_at)
+                    IS DISTINCT FROM (c.n, GREATEST(p.created_at, c.latest))
+        """, (lo, lo + batch_size))
+        fixed += cur.rowcount
+        conn.commit()
+
+    cur.close()
+    conn.close()
+    click.echo(f"comment counters: {fixed} post(s) corrected")
+
+
+@click.command("reindex-search")
+@with_appcontext
+@click.option("--batch-size", default=5000, show_default=True, help="Posts per transaction.")
+def reindex_search(batch_size):
+    """Rebuild posts.search_tsv (backfill after adding the column, or after bulk edits)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM posts")
+    max_id = cur.fetchone()[0]
+
+    for lo in range(0, max_id + 1, batch_size):
+        cur.execute(f"""
+            UPDATE posts p
+            SET search_tsv = {SEARCH_VECTOR_SQL}
+            WHERE p.id >= %s AND p.id < %s
+        """, (lo, lo + batch_size))
+        conn.commit()
+
+    cur.close()
+    conn.close()
+    click.echo(f"search_tsv rebuilt for posts up to id {max_id}")
+
+
+@click.command("refresh-hot-scores")
+@with_appcontext
+@click.option("--days", type=int, default=None, help="Posts created in the last N days (default: HOT_SCORE_WINDOW_DAYS).")
+def refresh_hot_scores_command(days):
+    """Recompute posts.hot_score now (backfill after adding the column: pass a large --days)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    changed = refresh_hot_scores(cur, days or current_app.config["HOT_SCORE_WINDOW_DAYS"])
+    conn.commit()
+    cur.close()
+    conn.close()
+    click.echo(f"hot_score: {changed} post(s) updated")
+
+
+@click.command("check-feed-plan")
+@with_appcontext
+@click.option("--tag", required=True, help="An existing keyword to plan the tag page for.")
+@click.option("--q", default="", help="Optional search text combined with the tag.")
+def check_feed_plan(tag, q):
+    """
+    Check the /feed?tag= query plan on this database with its own planner settings and
+    statistics (see post_helpers.feed_plan_problems). The regression test in
+    tests/test_feed_plan.py runs the same check against a seeded database.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    plan = explain_search(cur, q, tag)
+    conn.rollback()
+    cur.close()
+    conn.close()
+
+    for node in plan_nodes(plan):
+        rel = f" on {node['Relation Name']}" if "Relation Name" in node else ""
+        idx = f" using {node['Index Name']}" if "Index Name" in node else ""
+        join = f" ({node['Join Type']})" if "Join Type" in node else ""
+        click.echo(f"  {node['Node Type']}{join}{rel}{idx}")
+
+    problems = feed_plan_problems(plan)
+    if problems:
+        raise click.ClickException("feed plan regressed: " + "; ".join(problems))
+    click.echo("feed plan OK")
+
+
+@click.command("email-worker")
+@with_appcontext
+@click.option("--batch-size", default=50, show_default=True)
+@click.option("--poll-interval", default=2.0, show_default=True, help="Seconds to sleep when the outbox is empty.")
+@click.option("--once", is_flag=True, help="Send one batch and exit.")
+def email_worker(batch_size, poll_interval, once):
+    """Deliver queued email_outbox messages over a persistent SMTP session."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    worker = OutboxWorker(current_app)
+
+    if once:
+        handled = worker.run_once(batch_size)
+        worker.smtp.close()
+        click.echo(f"handled {handled} message(s): {worker.metrics}")
+        return
+
+    worker.run_forever(batch_size, poll_interval)
+
+
+@click.command("jobs-worker")
+@with_appcontext
+@click.option("--processes", type=int, default=None, help="Worker processes (default: MEDIA_WORKERS).")
+@click.option("--batch-size", type=int, default=None, help="Jobs claimed at a time (default: 2 x processes).")
+@click.option("--poll-interval", default=1.0, show_default=True, help="Seconds to sleep when no job is due.")
+@click.option("--once", is_flag=True, help="Run one batch and exit.")
+def jobs_worker(processes, batch_size, poll_interval, once):
+    """Run queued background jobs (media processing, hot score refresh, ...) on a process pool."""
+    import app.uploads  # noqa: F401  registers process_media
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # the hot score refresh re-queues itself; make sure one is waiting
+    conn = get_db_connection()
+    cur = conn.cursor()
+    config = current_app.config
+    schedule_refresh(cur, config["HOT_SCORE_WINDOW_DAYS"], config["HOT_SCORE_REFRESH_SECONDS"])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    processes = processes or current_app.config["MEDIA_WORKERS"]
+    worker = JobWorker(current_app, processes)
+    batch_size = batch_size or processes * 2
+
+    if once:
+        handled = worker.run_once(batch_size)
+        worker.executor.shutdown()
+        click.echo(f"handled {handled} job(s): {worker.metrics}")
+        return
+
+    worker.run_forever(batch_size, poll_interval)
+
+
+@click.command("backfill-media-variants")
+@with_appcontext
+def backfill_media_variants():
+    """Queue media_variants jobs for ready media that has no srcset renditions yet."""
+    import app.uploads  # noqa: F401  registers media_variants
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT pm.post_id, pm.file_path
+        FROM post_media pm
+        WHERE pm.status = 'ready'
+            AND NOT EXISTS (SELECT 1 FROM post_media_variants v WHERE v.post_id = pm.post_id)
+    """)
+    rows = cur.fetchall()
+
+    upload_dir = os.path.abspath(current_app.config["UPLOAD_FOLDER"])
+    widths = list(current_app.config["MEDIA_VARIANT_WIDTHS"])
+    cur.executemany("""
+        INSERT INTO jobs (kind, payload) VALUES ('media_variants', %s)
+    """, [
+        (json.dumps({
+            "post_id": post_id,
+            "path": os.path.join(upload_dir, file_path),
+            "kind": os.path.splitext(file_path)[1].lstrip(".").lower(),
+            "widths": widths,
+        }),)
+        for post_id, file_path in rows
+    ])
+    conn.commit()
+    cur.close()
+    conn.close()
+    click.echo(f"queued {len(rows)} media_variants job(s)")
+
+
+def _older_than(path, cutoff):
+    try:
+        return os.path.getmtime(path) < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+@click.command("gc-media")
+@with_appcontext
+@click.option("--grace-hours", default=24, show_default=True, help="Keep unreferenced files at least this long.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be removed.")
+def gc_media(grace_hours, dry_run):
+    """
+    Remove media blobs that no post references any more (and their renditions), temp files
+    left by interrupted process_media jobs, expired upload sessions, and quarantined uploads
+    that no post or session is waiting on.
+    """
+    upload_dir = os.path.abspath(current_app.config["UPLOAD_FOLDER"])
+    quarantine_dir = os.path.abspath(current_app.config["QUARANTINE_FOLDER"])
+    cutoff = time.time() - grace_hours * 3600
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        DELETE FROM media_blobs b
+        WHERE b.ref_count = 0
+            AND COALESCE(b.unreferenced_at, b.created_at) < NOW() - make_interval(hours => %s)
+            AND NOT EXISTS (SELECT 1 FROM post_media pm WHERE pm.blob_sha256 = b.sha256)
+        RETURNING b.file_path, b.variants
+    """, (grace_hours,))
+    blobs = cur.fetchall()
+
+    cur.execute("SELECT file_path FROM post_media WHERE status = 'processing'")
+    waiting = {r[0] for r in cur.fetchall()}
+
+    cur.execute("DELETE FROM upload_sessions WHERE expires_at < NOW() RETURNING id")
+    expired_sessions = [r[0] for r in cur.fetchall()]
+    cur.execute("SELECT id FROM upload_sessions")
+    waiting.update(f"{r[0]}.part" for r in cur.fetchall())
+
+    if dry_run:
+        conn.rollback()
+    else:
+        conn.commit()
+    cur.close()
+    conn.close()
+
+    doomed = []
+    for file_path, variants in blobs:
+        doomed.append(os.path.join(upload_dir, file_path))
+        doomed.extend(os.path.join(upload_dir, v["file_path"]) for v in variants)
+
+    if os.path.isdir(upload_dir):
+        doomed.extend(
+            os.path.join(upload_dir, name) for name in os.listdir(upload_dir)
+            if name.startswith(".tmp-") and _older_than(os.path.join(upload_dir, name), cutoff)
+        )
+    doomed.extend(os.path.join(quarantine_dir, f"{upload_id}.part") for upload_id in expired_sessions)
+    if os.path.isdir(quarantine_dir):
+        doomed.extend(
+            os.path.join(quarantine_dir, name) for name in os.listdir(quarantine_dir)
+            if name not in waiting and _older_than(os.path.join(quarantine_dir, name), cutoff)
+        )
+
+    if dry_run:
+        for path in doomed:
+            click.echo(f"  would remove {path}")
+        click.echo(f"{len(blobs)} blob(s), {len(doomed)} file(s) eligible")
+        return
+
+    removed = sum(_remove(path) for path in doomed)
+    click.echo(f"removed {len(blobs)} blob(s), {removed} file(s)")
+
+
+def _legacy_vote(cur, post_id, user_id, value):
+    # the pre-toggle_post_vote path: read, write, then aggregate post_votes (4 round-trips with the commit)
+    cur.execute("SELECT value FROM post_votes WHERE post_id=%s AND user_id=%s", (post_id, user_id))
+    row = cur.fetchone()
+    if row and row[0] == value:
+        cur.execute("DELETE FROM post_votes WHERE post_id=%s AND user_id=%s", (post_id, user_id))
+    else:
+        cur.execute("""
+            INSERT INTO post_votes (post_id, user_id, value)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (post_id, user_id)
+            DO UPDATE SET value = EXCLUDED.value, created_at = NOW()
+        """, (post_id, user_id, value))
+    cur.execute("""
+        SELECT
+          COALESCE(SUM(value), 0),
+          COALESCE(SUM(CASE WHEN value = 1 THEN 1 ELSE 0 END), 0),
+          COALESCE(SUM(CASE WHEN value = -1 THEN 1 ELSE 0 END), 0)
+        FROM post_votes
+        WHERE post_id = %s
+    """, (post_id,))
+    cur.fetchone()
+
+
+def _toggle_vote(cur, post_id, user_id, value):
+    cur.execute(
+        "SELECT score, likes, dislikes, user_vote FROM toggle_post_vote(%s, %s, %s::smallint)",
+        (post_id, user_id, value)
+    )
+    cur.fetchone()
+
+
+@click.command("bench-votes")
+@with_appcontext
+@click.option("--voters", default=20, show_default=True, help="Concurrent voters (existing user ids).")
+@click.option("--rounds", default=50, show_default=True, help="Votes cast per voter.")
+def bench_votes(voters, rounds):
+    """
+    Compare the old multi-statement vote path with toggle_post_vote under
+    concurrent voters on one post. Each path votes on its own scratch post and every vote
+    is committed, so the timings include the commit; the scratch posts and their votes are
+    deleted afterwards.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM users ORDER BY id LIMIT %s", (voters,))
+    user_ids = [r[0] for r in cur.fetchall()]
+
+    if len(user_ids) < voters:
+        cur.close()
+        conn.close()
+        raise click.ClickException(f"need {voters} users, found {len(user_ids)}")
+
+    # one dedicated connection per voter so the app pool size does not cap concurrency
+    dsn = dsn_from_config(current_app.config)
+
+    scratch = []
+    try:
+        for name, vote in (("legacy", _legacy_vote), ("toggle_post_vote", _toggle_vote)):
+            cur.execute("""
+                INSERT INTO posts (user_id, title, is_deleted)
+                VALUES (%s, 'bench-votes scratch post', TRUE)
+                RETURNING id
+            """, (user_ids[0],))
+            post_id = cur.fetchone()[0]
+            scratch.append(post_id)
+            conn.commit()
+
+            latencies = []
+            lock = threading.Lock()
+            # voters connect first, so connection setup stays out of the timed window
+            ready = threading.Barrier(len(user_ids) + 1)
+
+            def voter(user_id):
+                try:
+                    vconn = psycopg2.connect(**dsn)
+                except psycopg2.Error:
+                    ready.abort()
+                    raise
+                mine = []
+                try:
+                    vcur = vconn.cursor()
+                    ready.wait()
+                    for i in range(rounds):
+                        start = time.perf_counter()
+                        vote(vcur, post_id, user_id, 1 if i % 2 == 0 else -1)
+                        vconn.commit()
+                        mine.append(time.perf_counter() - start)
+                finally:
+                    vconn.close()
+                with lock:
+                    latencies.extend(mine)
+
+            threads = [threading.Thread(target=voter, args=(uid,)) for uid in user_ids]
+            for t in threads:
+                t.start()
+            try:
+                ready.wait()
+            except threading.BrokenBarrierError:
+                for t in threads:
+                    t.join()
+                raise click.ClickException("a voter could not connect to the database")
+            started = time.perf_counter()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            click.echo(
+                f"{name:>16}: {len(latencies) / elapsed:8.1f} votes/s  "
+                f"p50 {statistics.median(latencies) * 1000:6.2f} ms  p95 {p95 * 1000:6.2f} ms"
+            )
+    finally:
+        conn.rollback()
+        # votes and vote totals go with the posts (ON DELETE CASCADE)
+        cur.execute("DELETE FROM posts WHERE id = ANY(%s)", (scratch,))
+        conn.commit()
+        cur.close()
+        conn.close()
@@ -0,0 +1,113 @@
+from app.db import get_db
+from app.post_helpers import encode_cursor
+
+THREADS_PAGE_SIZE = 20   # top-level comments per page
+REPLIES_PER_COMMENT = 3  # replies loaded under each comment before "load more replies"
+MAX_DEPTH = 3            # reply levels loaded below each root before "continue thread"
+
+# Loads up to `limit` root comments plus a bounded window of their replies in one query.
+# Each level takes at most REPLIES_PER_COMMENT + 1 children per comment (the extra row only
+# tells us more exist and is not descended into), so a page costs at most
+# limit * (1 + (R+1) + (R+1)^2 + ...) rows however large the thread is.
+_TREE_SQL = """
+WITH RECURSIVE roots AS (
+    SELECT c.id, c.parent_comment_id, c.body, c.created_at, c.user_id
+    FROM comments c
+    WHERE {root_filter} AND c.is_deleted = FALSE {after}
+    ORDER BY c.created_at, c.id
+    LIMIT %(limit)s
+),
+tree AS (
+    SELECT r.id, r.parent_comment_id, r.body, r.created_at, r.user_id,
+        0 AS depth, 1::bigint AS rn
+    FROM roots r
+
+    UNION ALL
+
+    SELECT ch.id, ch.parent_comment_id, ch.body, ch.created_at, ch.user_id,
+        t.depth + 1, ch.rn
+    FROM tree t
+    CROSS JOIN LATERAL (
+        SELECT c.id, c.parent_comment_id, c.body, c.created_at, c.user_id,
+            row_number() OVER (ORDER BY c.created_at, c.id) AS rn
+        FROM comments c
+        WHERE c.parent_comment_id = t.id AND c.is_deleted = FALSE
+        ORDER BY c.created_at, c.id
+        LIMIT %(replies)s + 1
+    ) ch
+    WHERE t.depth < %(max_depth)s AND t.rn <= %(replies)s
+)
+SELECT t.id, t.parent_comment_id, t.body, t.created_at, u.username, t.user_id, t.depth, t.rn,
+    t.depth = %(max_depth)s AND EXISTS (
+        SELECT 1 FROM comments x WHERE x.parent_comment_id = t.id AND x.is_deleted = FALSE
+    ) AS has_hidden_replies
+FROM tree t
+JOIN users u ON u.id = t.user_id
+ORDER BY t.depth, t.created_at, t.id
+"""
+
+
+def _load_tree(root_filter, params, after, limit, base_depth=0):
+    after_sql = ""
+    if after:
+        after_sql = "AND (c.created_at, c.id) > (%(after_created)s, %(after_id)s)"
+        params = dict(params, after_created=after[0], after_id=after[1])
+
+    cur = get_db().cursor()
+    cur.execute(
+        _TREE_SQL.format(root_filter=root_filter, after=after_sql),
+        dict(params, limit=limit + 1, replies=REPLIES_PER_COMMENT, max_depth=MAX_DEPTH),
+    )
+    rows = cur.fetchall()
+    cur.close()
+
+    nodes = {}
+    roots = []
+    for cid, parent_id, body, created_at, username, user_id, depth, rn, has_hidden in rows:
+        node = {
+            "id": cid, "parent_id": parent_id, "body": body, "created_at": created_at,
+            "username": username, "user_id": user_id, "depth": depth + base_depth,
+            "replies": [],
+            # cursor for "load more replies": None = nothing more, "" = from the first reply
+            "more_replies": "" if has_hidden else None,
+        }
+        if depth == 0:
+            roots.append(node)
+            nodes[cid] = node
+            continue
+
+        parent = nodes.get(parent_id)
+        if parent is None:
+            continue
+        if rn > REPLIES_PER_COMMENT:
+            last = parent["replies"][-1]
+            parent["more_replies"] = encode_cursor(last["created_at"], last["id"])
+            continue
+        parent["replies"].append(node)
+        nodes[cid] = node
+
+    next_cursor = None
+    if len(roots) > limit:
+        roots = roots[:limit]
+        last = roots[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    return roots, next_cursor
+
+
+def get_comment_threads(post_id: int, after=None, limit=THREADS_PAGE_SIZE):
+    """
+    One page of top-level comments on a post, oldest first, each with a bounded window of replies.
+    Returns (threads, next_cursor).
+    """
+    return _load_tree(
+        "c.post_id = %(post_id)s AND c.parent_comment_id IS NULL",
+        {"post_id": post_id}, after, limit,
+    )
+
+
+def get_comment_replies(comment_id: int, after=None, limit=THREADS_PAGE_SIZE):
+    """The next page of replies to one comment, shaped like get_comment_threads."""
+    return _load_tree(
+        "c.parent_comment_id = %(parent_id)s",
+        {"parent_id": comment_id}, after, limit, base_depth=1,
+    )
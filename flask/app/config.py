@@ -13,15 +13,94 @@ class Config:
     DB_PASSWORD = "postgres"
     DB_PORT = 5432
 
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))   # seconds to wait for a free connection
+    DB_POOL_PING = os.getenv("DB_POOL_PING", "1") == "1"       # SELECT 1 on checkout
+
+    # process-level permission cache; 0 disables it (sets are still loaded once per request)
+    PERMISSIONS_CACHE_TTL = int(os.getenv("PERMISSIONS_CACHE_TTL", 30))
+    # role / blocked / activated per user, checked by the auth decorators (security.get_user_status);
+    # changes made in another process are picked up within this many seconds
+    USER_STATUS_CACHE_TTL = int(os.getenv("USER_STATUS_CACHE_TTL", 30))
+
+    # bcrypt work factor; existing hashes with a different cost are re-hashed on login
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+    BCRYPT_MAX_CONCURRENCY = int(os.getenv("BCRYPT_MAX_CONCURRENCY", os.cpu_count() or 2))
+    # hashes allowed to wait behind the running ones; past that, requests wait at most
+    # BCRYPT_QUEUE_TIMEOUT seconds for a place in the queue, then get a 503
+    BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", 4 * BCRYPT_MAX_CONCURRENCY))
+    BCRYPT_QUEUE_TIMEOUT = float(os.getenv("BCRYPT_QUEUE_TIMEOUT", 1))
+
     SMTP_EMAIL = os.getenv("SMTP_EMAIL")
     SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
     SMTP_HOST = os.getenv("SMTP_HOST")
-    SMTP_PORT = os.getenv("SMTP_PORT")
+    SMTP_PORT = os.getenv("SMTP_PORT")   # default: 465 / 587 / 25 by SMTP_SECURITY
+    SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")   # ssl | starttls | none (local stand-in server)
+    SMTP_TIMEOUT = 30
+
+    # email_outbox delivery by `flask email-worker`
+    EMAIL_MAX_ATTEMPTS = 8
+    EMAIL_RETRY_BASE_SECONDS = 30
+    EMAIL_RETRY_MAX_SECONDS = 3600
 
     UPLOAD_FOLDER = "flask/uploads" 
+    QUARANTINE_FOLDER = "flask/quarantine"   # raw uploads and chunked upload sessions waiting for processing
+    MEDIA_VARIANT_WIDTHS = (320, 640, 1080)    # srcset renditions for feed cards
     MAX_CONTENT_LENGTH = 25 * 1024 * 1024   #25 MB
+    MAX_VIDEO_UPLOAD_BYTES = 200 * 1024 * 1024   # videos may exceed MAX_CONTENT_LENGTH via chunked upload sessions
+    UPLOAD_CHUNK_BYTES = 5 * 1024 * 1024         # chunk size suggested to the browser
+
+    # /media/<name> byte transfer: None streams from Python; "x-accel" hands off to nginx via
+    # X-Accel-Redirect to MEDIA_ACCEL_PREFIX (an `internal` location aliased to UPLOAD_FOLDER);
+    # "x-sendfile" sets X-Sendfile for Apache mod_xsendfile / lighttpd
+    MEDIA_SENDFILE = os.getenv("MEDIA_SENDFILE") or None
+    MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/_media/")
+    MEDIA_STAT_CACHE_TTL = int(os.getenv("MEDIA_STAT_CACHE_TTL", 300))
+
+    # most user or post ids one /admin/.../bulk request may name
+    BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
+    # cascading bans hide up to this many posts + comments in the request, larger
+    # histories in ban_cascade jobs of BAN_CASCADE_BATCH rows per table
+    BAN_CASCADE_SYNC_LIMIT = int(os.getenv("BAN_CASCADE_SYNC_LIMIT", 2000))
+    BAN_CASCADE_BATCH = int(os.getenv("BAN_CASCADE_BATCH", 5000))
+
+    # rendered feed cards kept per process (LRU), see app/fragments.py
+    CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", 5000))
+
+    # whole-page cache for logged-out visitors on / and /feed?tag=, see app/page_cache.py;
+    # PAGE_CACHE_TTL = 0 disables it
+    PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory")   # memory | redis
+    PAGE_CACHE_REDIS_URL = os.getenv("PAGE_CACHE_REDIS_URL", "redis://valkey:6379/0")
+    PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 10))
+    PAGE_CACHE_STALE_SECONDS = int(os.getenv("PAGE_CACHE_STALE_SECONDS", 60))
+    PAGE_CACHE_WAIT = 2.0   # seconds a request waits for another one rendering the same page
+    PAGE_CACHE_SIZE = 1000  # entries, memory backend only
+
+    # token buckets in front of the auth endpoints, see app/rate_limit.py:
+    # rule -> {"ip": (burst, period seconds), "account": (burst, period seconds)}
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")   # memory | redis
+    RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://valkey:6379/1")
+    RATE_LIMIT_MAX_KEYS = 100_000   # buckets per process, memory backend only
+    RATE_LIMITS = {
+        "login": {"ip": (30, 300), "account": (10, 300)},
+        "register": {"ip": (10, 3600), "account": (5, 3600)},
+        "resend_activation": {"ip": (10, 3600), "account": (3, 3600)},
+        "forgot_password": {"ip": (10, 3600), "account": (3, 3600)},
+    }
 
     ALLOWED_IMAGE_EXT = {"png", "jpg", "jpeg", "webp"}  
     ALLOWED_GIF_EXT = {"gif"}                           
     ALLOWED_VIDEO_EXT = {"mp4", "webm"}  
 
+    # background jobs run by `flask jobs-worker`
+    MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", 2))   # worker processes
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BASE_SECONDS = 10
+    JOB_RETRY_MAX_SECONDS = 600
+
+    # posts.hot_score refresh (app/ranking.py), queued by `flask jobs-worker` on start;
+    # the hot feed reflects new votes after at most this many seconds
+    HOT_SCORE_WINDOW_DAYS = int(os.getenv("HOT_SCORE_WINDOW_DAYS", 7))
+    HOT_SCORE_REFRESH_SECONDS = int(os.getenv("HOT_SCORE_REFRESH_SECONDS", 60))
+
@@ -1,5 +1,5 @@
 from flask import session
-from app.db import get_db_connection
+from app.security import get_user_permissions
 
 def inject_permissions():
     if not session.get("user_id"):
@@ -8,15 +8,4 @@ def inject_permissions():
     if session.get("role") == "admin":
         return {"user_permissions": {"*"}}
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT permission_key
-        FROM user_permissions
-        WHERE user_id = %s
-    """, (session["user_id"],))
-    perms = {r[0] for r in cur.fetchall()}
-    cur.close()
-    conn.close()
-
-    return {"user_permissions": perms}
+    return {"user_permissions": get_user_permissions(session["user_id"])}
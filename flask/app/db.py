@@ -1,11 +1,191 @@
+import atexit
+import threading
+
 import psycopg2
-from flask import current_app
+from psycopg2 import extensions, pool
+from flask import current_app, g
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled psycopg2 connection.
+    close() hands the connection back to the pool instead of closing the socket,
+    so existing `conn.close()` calls keep working unchanged.
+    """
+
+    def __init__(self, db_pool, conn):
+        self._pool = db_pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        return False
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.putconn(conn)
+
+
+class DatabasePool:
+    """
+    Bounded pool of psycopg2 connections.
+    getconn() blocks up to DB_POOL_TIMEOUT seconds when every connection is checked out
+    and pings each connection before handing it out.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, ping, **dsn):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        self._ping = ping
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise pool.PoolError("connection pool exhausted")
+
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        try:
+            broken = conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        if not self._pool.closed:
+            self._pool.closeall()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self._ping:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pool_lock = threading.Lock()
+
+
+def dsn_from_config(config):
+    return {
+        "host": config["DB_HOST"],
+        "port": config["DB_PORT"],
+        "database": config["DB_NAME"],
+        "user": config["DB_USER"],
+        "password": config["DB_PASSWORD"],
+    }
+
+
+def init_app(app):
+    app.extensions["db_pool"] = None
+    app.after_request(_end_request_transaction)
+    app.teardown_appcontext(_return_connections)
+
+
+def get_pool():
+    app = current_app._get_current_object()
+    db_pool = app.extensions.get("db_pool")
+    if db_pool is not None:
+        return db_pool
+
+    with _pool_lock:
+        db_pool = app.extensions.get("db_pool")
+        if db_pool is None:
+            db_pool = DatabasePool(
+                app.config["DB_POOL_MIN"],
+                app.config["DB_POOL_MAX"],
+                app.config["DB_POOL_TIMEOUT"],
+                app.config["DB_POOL_PING"],
+                **dsn_from_config(app.config),
+            )
+            app.extensions["db_pool"] = db_pool
+            atexit.register(db_pool.closeall)
+    return db_pool
+
 
 def get_db_connection():
-    return psycopg2.connect(
-        host=current_app.config["DB_HOST"],
-        port=current_app.config["DB_PORT"],
-        database=current_app.config["DB_NAME"],
-        user=current_app.config["DB_USER"],
-        password=current_app.config["DB_PASSWORD"],
-    )
+    conn = get_pool().getconn()
+    g.setdefault("_db_checked_out", []).append(conn)
+    return conn
+
+
+def get_db():
+    """
+    Connection shared by everything that runs during the current request.
+    The request runs as one transaction: committed before a successful response is sent,
+    rolled back on an error response or an unhandled exception.
+    Callers must not close() it.
+    """
+    if "db" not in g:
+        g.db = get_pool().getconn()
+    return g.db
+
+
+def call_after_commit(fn):
+    """
+    Run fn() once the request transaction has been committed, e.g. to drop cache
+    entries only after the new rows are visible to other requests. JobWorker does the
+    same for the transaction a job's finish() runs in.
+    Outside a transaction fn() runs immediately.
+    """
+    if g.get("db") is None and "_after_commit" not in g:
+        fn()
+        return
+    g.setdefault("_after_commit", []).append(fn)
+
+
+def _end_request_transaction(response):
+    conn = g.get("db")
+    if conn is None or conn.closed:
+        return response
+
+    if response.status_code < 400:
+        conn.commit()
+        for fn in g.pop("_after_commit", []):
+            fn()
+    else:
+        conn.rollback()
+        g.pop("_after_commit", None)
+    return response
+
+
+def _return_connections(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        # anything not committed by _end_request_transaction is rolled back by the pool
+        conn.close()
+
+    # handlers that abort() before conn.close() would otherwise leak their connection
+    for conn in g.pop("_db_checked_out", []):
+        conn.close()
@@ -1,14 +1,35 @@
 from functools import wraps
 from flask import session, abort, redirect, url_for
-from app.db import get_db_connection
+from app.security import user_has_permission, get_user_status
+
+def _current_status():
+    """
+    Status of the logged-in user from the user-status cache, or None if there is no usable
+    session. A blocked, deactivated or deleted account is logged out on its next request.
+    """
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+
+    status = get_user_status(user_id)
+    if status is None or status.is_blocked or not status.is_activated:
+        session.clear()
+        session.modified = True
+        return None
+
+    # role changes apply without logging in again (templates read session["role"])
+    if session.get("role") != status.role:
+        session["role"] = status.role
+    return status
 
 def roles_required(*roles):
     def decorator(fn):
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            if not session.get("user_id"):
+            status = _current_status()
+            if status is None:
                 abort(401)
-            if session.get("role") not in roles:
+            if status.role not in roles:
                 abort(403)
             return fn(*args, **kwargs)
         return wrapper
@@ -17,7 +38,7 @@ def roles_required(*roles):
 def login_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        if not session.get("user_id"):
+        if _current_status() is None:
             return redirect(url_for("auth.login_get"))
         return fn(*args, **kwargs)
     return wrapper
@@ -27,26 +48,14 @@ def permission_required(permission_key: str):
     def decorator(fn):
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            if not session.get("user_id"):
+            status = _current_status()
+            if status is None:
                 abort(401)
 
-            if session.get("role") == "admin":
+            if status.role == "admin":
                 return fn(*args, **kwargs)
 
-            user_id = session["user_id"]
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT 1
-                FROM user_permissions
-                WHERE user_id = %s AND permission_key = %s
-                LIMIT 1
-            """, (user_id, permission_key))
-            ok = cur.fetchone() is not None
-            cur.close()
-            conn.close()
-
-            if not ok:
+            if not user_has_permission(session["user_id"], permission_key):
                 abort(403)
 
             return fn(*args, **kwargs)
@@ -1,47 +1,217 @@
-from flask import url_for, current_app
+from flask import url_for
 from email.mime.text import MIMEText
+import logging
 import secrets
-from datetime import datetime, timedelta
 import smtplib
+import time
+from datetime import datetime, timedelta
+from app.db import get_db, get_pool
 
-def send_token(email):
-    send_email = current_app.config["SMTP_EMAIL"]
-    send_password = current_app.config["SMTP_PASSWORD"]
-    MAIL_HOST = current_app.config["SMTP_HOST"]
-    MAIL_PORT = current_app.config["SMTP_PORT"]   
+log = logging.getLogger(__name__)
+
+def queue_email(to_addr, subject, body):
+    """
+    Adds a message to email_outbox inside the current request transaction,
+    so it is only delivered if the request commits. `flask email-worker` sends it.
+    """
+    cur = get_db().cursor()
+    cur.execute("""
+        INSERT INTO email_outbox (to_addr, subject, body)
+        VALUES (%s, %s, %s)
+    """, (to_addr, subject, body))
+    cur.close()
 
+def send_token(email):
     token = secrets.token_urlsafe(32)
     expiry = datetime.now() + timedelta(hours=24)
     link = url_for("auth.activate", token=token, _external=True)
 
-    msg = MIMEText(f"Click to activate:\n{link}")
-    msg["Subject"] = "Account Activation"
-    msg["From"] = send_email
-    msg["To"] = email
-
-    with smtplib.SMTP_SSL(MAIL_HOST, MAIL_PORT) as smtp:
-        smtp.login(
-            send_email,
-            send_password,
-        )
-        smtp.send_message(msg)
+    queue_email(email, "Account Activation", f"Click to activate:\n{link}")
 
     return token, expiry
 
 def send_reset_email(email, token):
-    send_email = current_app.config["SMTP_EMAIL"]
-    send_password = current_app.config["SMTP_PASSWORD"]
-    MAIL_HOST = current_app.config["SMTP_HOST"]
-    MAIL_PORT = current_app.config["SMTP_PORT"]   
-
     reset_link = url_for("auth.reset_password", token=token, _external=True)
     body = f"Click this link to reset your password:\n{reset_link}"
 
-    msg = MIMEText(body)
-    msg["Subject"] = "Password Reset"
-    msg["From"] = send_email
-    msg["To"] = email
+    queue_email(email, "Password Reset", body)
+
+
+# SMTP_SECURITY -> port used when SMTP_PORT is not set
+DEFAULT_SMTP_PORTS = {"ssl": 465, "starttls": 587, "none": 25}
+
+
+class SMTPSession:
+    """
+    Keeps one SMTP connection open across messages and reconnects when the server drops it.
+    SMTP_SECURITY is "ssl" (implicit TLS), "starttls" or "none" - the latter for a local
+    stand-in server such as the mailpit service in compose.yaml.
+    """
+
+    def __init__(self, config):
+        self.host = config["SMTP_HOST"]
+        self.security = config["SMTP_SECURITY"]
+        self.port = int(config.get("SMTP_PORT") or DEFAULT_SMTP_PORTS.get(self.security, 25))
+        self.sender = config["SMTP_EMAIL"]
+        self.password = config["SMTP_PASSWORD"]
+        self.timeout = config["SMTP_TIMEOUT"]
+        self._smtp = None
+        self.connects = 0
+
+    def _connect(self):
+        if self.security == "ssl":
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                smtp.starttls()
+        if self.password:
+            smtp.login(self.sender, self.password)
+        self.connects += 1
+        return smtp
+
+    def send(self, to_addr, subject, body):
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = to_addr
+
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # idle connection was closed by the server; retry once on a fresh one
+            self._smtp = self._connect()
+            self._smtp.send_message(msg)
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            pass
+        self._smtp = None
+
+
+class OutboxWorker:
+    """
+    Drains email_outbox. A batch is claimed by pushing its next_attempt_at out by a lease,
+    so several workers can run side by side and rows held by a crashed worker come back
+    once the lease expires. The lease on the rest of the batch is renewed with every
+    message, so a slow SMTP server cannot let it run out while this worker still holds them.
+    Failures are retried with exponential backoff until EMAIL_MAX_ATTEMPTS, after which the
+    row is marked failed.
+    """
+
+    # renewed per message, so it only has to outlast one: connect, TLS, login and send,
+    # each bounded by SMTP_TIMEOUT, plus one reconnect
+    CLAIM_LEASE_SECONDS = 300
+
+    def __init__(self, app):
+        self.config = app.config
+        self.smtp = SMTPSession(app.config)
+        self.metrics = {"sent": 0, "retried": 0, "failed": 0, "batches": 0}
+
+    def _backoff(self, attempts):
+        base = self.config["EMAIL_RETRY_BASE_SECONDS"]
+        return min(base * 2 ** (attempts - 1), self.config["EMAIL_RETRY_MAX_SECONDS"])
+
+    def run_once(self, batch_size):
+        """Sends one batch of due messages; returns how many rows were handled."""
+        conn = get_pool().getconn()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE email_outbox
+                SET next_attempt_at = NOW() + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id
+                    FROM email_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, to_addr, subject, body, attempts
+            """, (self.CLAIM_LEASE_SECONDS, batch_size))
+            rows = cur.fetchall()
+            conn.commit()
+
+            for i, (msg_id, to_addr, subject, body, attempts) in enumerate(rows):
+                attempts += 1
+                try:
+                    self.smtp.send(to_addr, subject, body)
+                except (smtplib.SMTPException, OSError) as e:
+                    self.smtp.close()
+                    give_up = attempts >= self.config["EMAIL_MAX_ATTEMPTS"]
+                    cur.execute("""
+                        UPDATE email_outbox
+                        SET attempts = %s,
+                            status = %s,
+                            last_error = %s,
+                            next_attempt_at = NOW() + make_interval(secs => %s)
+                        WHERE id = %s
+                    """, (attempts, "failed" if give_up else "pending", str(e)[:500],
+                          self._backoff(attempts), msg_id))
+                    self.metrics["failed" if give_up else "retried"] += 1
+                    log.warning("email %s to %s failed (attempt %s): %s", msg_id, to_addr, attempts, e)
+                else:
+                    cur.execute("""
+                        UPDATE email_outbox
+                        SET attempts = %s, status = 'sent', sent_at = NOW(), last_error = NULL
+                        WHERE id = %s
+                    """, (attempts, msg_id))
+                    self.metrics["sent"] += 1
+
+                waiting = [r[0] for r in rows[i + 1:]]
+                if waiting:
+                    cur.execute("""
+                        UPDATE email_outbox
+                        SET next_attempt_at = NOW() + make_interval(secs => %s)
+                        WHERE id = ANY(%s) AND status = 'pending'
+                    """, (self.CLAIM_LEASE_SECONDS, waiting))
+                conn.commit()
+
+            self.metrics["batches"] += 1
+            return len(rows)
+        finally:
+            cur.close()
+            conn.close()
+
+    def run_forever(self, batch_size, poll_interval):
+        last_report = time.monotonic()
+        try:
+            while True:
+                handled = self.run_once(batch_size)
+                if time.monotonic() - last_report >= 60:
+                    log.info("email outbox worker: %s, smtp_connects=%s", self.metrics, self.smtp.connects)
+                    last_report = time.monotonic()
+                if handled < batch_size:
+                    time.sleep(poll_interval)
+        finally:
+            self.smtp.close()
+
+
+def outbox_metrics(cur):
+    cur.execute("""
+        SELECT
+            COUNT(*) FILTER (WHERE status = 'pending'),
+            COUNT(*) FILTER (WHERE status = 'pending' AND attempts > 0),
+            COUNT(*) FILTER (WHERE status = 'failed'),
+            EXTRACT(EPOCH FROM NOW() - MIN(created_at) FILTER (WHERE status = 'pending'))
+        FROM email_outbox
+        WHERE status <> 'sent'
+    """)
+    pending, retrying, failed, oldest = cur.fetchone()
 
-    with smtplib.SMTP_SSL(MAIL_HOST, MAIL_PORT) as smtp:
-        smtp.login(send_email, send_password)
-        smtp.send_message(msg)
+    cur.execute("SELECT COUNT(*) FROM email_outbox WHERE sent_at > NOW() - INTERVAL '1 hour'")
+    sent_last_hour = cur.fetchone()[0]
+    return {
+        "pending": pending,
+        "retrying": retrying,
+        "failed": failed,
+        "sent_last_hour": sent_last_hour,
+        "oldest_pending_seconds": float(oldest) if oldest is not None else None,
+    }
@@ -0,0 +1,59 @@
+from jinja2 import pass_context
+from markupsafe import Markup
+from flask import current_app
+
+from app.cache import LRUCache
+from app.db import call_after_commit
+
+# post_id -> (stamp, html before the vote buttons, html after them). The html is the same
+# for every viewer; the buttons, which show the viewer's own vote, are rendered per request.
+card_cache = LRUCache()
+
+# emitted once by _feed_card.html, outside any user-supplied field (those are escaped, so
+# they can never contain it)
+VOTES_MARKER = "<!--feed-card-votes-->"
+
+
+def init_app(app):
+    card_cache.maxsize = app.config["CARD_CACHE_SIZE"]
+    app.add_template_global(feed_card)
+
+
+@pass_context
+def feed_card(ctx, p):
+    """
+    HTML for one feed card, from the fragment cache when the post is unchanged.
+    Reads keywords_by_post / vote_by_post / activity_by_post / variants_by_post from the
+    calling template. The stamp is posts.card_version (bumped on delete, recover and media
+    changes) plus the vote totals and comment count, so other processes' writes are picked
+    up without cross-process invalidation.
+    """
+    post_id = p[0]
+    v = (ctx.get("vote_by_post") or {}).get(post_id, {})
+    a = (ctx.get("activity_by_post") or {}).get(post_id, {})
+    stamp = (p[9], v.get("likes", 0), v.get("dislikes", 0), v.get("score", 0), a.get("comments", 0))
+
+    entry = card_cache.get(post_id, valid=lambda e: e[0] == stamp)
+    if entry is None:
+        html = current_app.jinja_env.get_template("_feed_card.html").render(
+            p=p,
+            kws=(ctx.get("keywords_by_post") or {}).get(post_id, []),
+            v=v,
+            a=a,
+            mv=(ctx.get("variants_by_post") or {}).get(post_id, {}),
+        )
+        head, _, tail = html.partition(VOTES_MARKER)
+        entry = (stamp, head, tail)
+        card_cache.set(post_id, entry)
+
+    votes = current_app.jinja_env.get_template("_feed_card_votes.html").render(
+        p=p,
+        v=v,
+        user_vote=v.get("user_vote", 0),
+    )
+    return Markup(entry[1] + votes + entry[2])
+
+
+def invalidate_card(post_id):
+    """Drops this process's cached card once the current transaction commits."""
+    call_after_commit(lambda: card_cache.delete(post_id))
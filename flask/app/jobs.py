@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flask import g
+
+from app.db import get_db, get_pool
+
+log = logging.getLogger(__name__)
+
+JobKind = namedtuple("JobKind", "run finish fail")
+
+# kind -> JobKind, filled in by register_job() from the modules that own each job
+_registry = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a job's run function when retrying cannot succeed."""
+
+
+def register_job(kind, run, finish=None, fail=None):
+    """
+    run(payload) -> result executes in a worker process and must not touch the database;
+    it has to be a module-level function so it can be pickled.
+    finish(cur, payload, result) and fail(cur, payload, error) run in the worker's main
+    process, inside the transaction that marks the job done or failed; finish() may use
+    db.call_after_commit for work that must wait until that transaction commits.
+    """
+    _registry[kind] = JobKind(run, finish, fail)
+
+
+def enqueue_job(kind, payload, delay_seconds=0):
+    """
+    Adds a job inside the current request transaction, so it only runs if the request commits.
+    `flask jobs-worker` picks it up.
+    """
+    if kind not in _registry:
+        raise ValueError(f"unknown job kind {kind!r}")
+
+    cur = get_db().cursor()
+    cur.execute("""
+        INSERT INTO jobs (kind, payload, run_after)
+        VALUES (%s, %s, NOW() + make_interval(secs => %s))
+    """, (kind, json.dumps(payload), delay_seconds))
+    cur.close()
+
+
+class JobWorker:
+    """
+    Drains the jobs table onto a process pool. Jobs are claimed with a lease the same way
+    OutboxWorker claims email, so several workers can share the table and jobs held by a
+    crashed worker are picked up again once the lease expires.
+    """
+
+    CLAIM_LEASE_SECONDS = 600
+
+    def __init__(self, app, processes):
+        self.config = app.config
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.metrics = {"done": 0, "retried": 0, "failed": 0, "batches": 0}
+
+    def _backoff(self, attempts):
+        base = self.config["JOB_RETRY_BASE_SECONDS"]
+        return min(base * 2 ** (attempts - 1), self.config["JOB_RETRY_MAX_SECONDS"])
+
+    def run_once(self, batch_size):
+        """Runs one batch of due jobs; returns how many were handled."""
+        conn = get_pool().getconn()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE jobs
+                SET status = 'running',
+                    attempts = attempts + 1,
+                    run_after = NOW() + make_interval(secs => %s),
+                    updated_at = NOW()
+                WHERE id IN (
+                    SELECT id
+                    FROM jobs
+                    WHERE status IN ('pending', 'running') AND run_after <= NOW()
+                    ORDER BY run_after
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, kind, payload, attempts
+            """, (self.CLAIM_LEASE_SECONDS, batch_size))
+            rows = cur.fetchall()
+            conn.commit()
+
+            futures = {}
+            for job_id, kind, payload, attempts in rows:
+                job = _registry.get(kind)
+                if job is None:
+                    self._fail(cur, job_id, None, payload, attempts, f"unknown job kind {kind!r}", permanent=True)
+                    conn.commit()
+                    continue
+                futures[self.executor.submit(job.run, payload)] = (job_id, job, payload, attempts)
+
+            for future in as_completed(futures):
+                job_id, job, payload, attempts = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    conn.rollback()
+                    self._fail(cur, job_id, job, payload, attempts, f"{type(e).__name__}: {e}",
+                               permanent=isinstance(e, PermanentJobError))
+                else:
+                    g._after_commit = []
+                    try:
+                        if job.finish:
+                            job.finish(cur, payload, result)
+                        cur.execute("""
+                            UPDATE jobs
+                            SET status = 'done', last_error = NULL, updated_at = NOW()
+                            WHERE id = %s
+                        """, (job_id,))
+                        conn.commit()
+                        self.metrics["done"] += 1
+                    except Exception as e:
+                        g.pop("_after_commit", None)
+                        conn.rollback()
+                        self._fail(cur, job_id, job, payload, attempts, f"{type(e).__name__}: {e}")
+                    else:
+                        # the job is done whatever happens here
+                        for fn in g.pop("_after_commit"):
+                            try:
+                                fn()
+                            except Exception:
+                                log.exception("after-commit hook of job %s failed", job_id)
+                conn.commit()
+
+            self.metrics["batches"] += 1
+            return len(rows)
+        finally:
+            cur.close()
+            conn.close()
+
+    def _fail(self, cur, job_id, job, payload, attempts, error, permanent=False):
+        give_up = permanent or attempts >= self.config["JOB_MAX_ATTEMPTS"]
+        if give_up and job and job.fail:
+            job.fail(cur, payload, error)
+
+        cur.execute("""
+            UPDATE jobs
+            SET status = %s,
+                last_error = %s,
+                run_after = NOW() + make_interval(secs => %s),
+                updated_at = NOW()
+            WHERE id = %s
+        """, ("failed" if give_up else "pending", error[:500], self._backoff(attempts), job_id))
+        self.metrics["failed" if give_up else "retried"] += 1
+        log.warning("job %s failed (attempt %s%s): %s", job_id, attempts, ", giving up" if give_up else "", error)
+
+    def run_forever(self, batch_size, poll_interval):
+        last_report = time.monotonic()
+        try:
+            while True:
+                handled = self.run_once(batch_size)
+                if time.monotonic() - last_report >= 60:
+                    log.info("jobs worker: %s", self.metrics)
+                    last_report = time.monotonic()
+                if handled < batch_size:
+                    time.sleep(poll_interval)
+        finally:
+            self.executor.shutdown()
@@ -0,0 +1,186 @@
+import base64
+import json
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request, session, make_response, copy_current_request_context
+
+from app.cache import TTLCache
+
+try:
+    import redis
+except ImportError:  # optional: only needed for PAGE_CACHE_BACKEND = "redis"
+    redis = None
+
+
+class MemoryPageBackend:
+    """Per-process backend: entries in a TTLCache, recompute locks in a dict."""
+
+    def __init__(self, maxsize):
+        self._entries = TTLCache(maxsize=maxsize)
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry, ttl):
+        self._entries.set(key, entry, ttl)
+
+    def acquire(self, key, ttl):
+        now = time.monotonic()
+        with self._mutex:
+            if self._locks.get(key, 0) > now:
+                return False
+            self._locks[key] = now + ttl
+            return True
+
+    def release(self, key):
+        with self._mutex:
+            self._locks.pop(key, None)
+
+
+class RedisPageBackend:
+    """Shared backend for every worker process, on Redis or a compatible server (valkey in compose.yaml)."""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("PAGE_CACHE_BACKEND=redis needs the 'redis' package")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        entry["body"] = base64.b64decode(entry["body"])
+        return entry
+
+    def set(self, key, entry, ttl):
+        data = dict(entry, body=base64.b64encode(entry["body"]).decode())
+        self._client.set(key, json.dumps(data), ex=max(1, int(ttl)))
+
+    def acquire(self, key, ttl):
+        return bool(self._client.set(f"{key}:lock", "1", nx=True, ex=max(1, int(ttl))))
+
+    def release(self, key):
+        self._client.delete(f"{key}:lock")
+
+
+class PageCache:
+    """
+    Whole-response cache for pages that look the same to every anonymous visitor.
+    Fresh for PAGE_CACHE_TTL seconds, then served stale for up to PAGE_CACHE_STALE_SECONDS
+    while one background refresh runs. On a cold miss only the request holding the
+    recompute lock renders the page; the others wait up to PAGE_CACHE_WAIT for its result.
+    """
+
+    LOCK_SECONDS = 30
+
+    def __init__(self):
+        self.backend = None
+        self._stats = {"hits": 0, "stale": 0, "misses": 0, "coalesced": 0, "refreshes": 0}
+        self._stats_lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config["PAGE_CACHE_BACKEND"] == "redis":
+            self.backend = RedisPageBackend(app.config["PAGE_CACHE_REDIS_URL"])
+        else:
+            self.backend = MemoryPageBackend(app.config["PAGE_CACHE_SIZE"])
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _respond(self, entry, state):
+        resp = current_app.response_class(entry["body"], status=entry["status"], mimetype=entry["mimetype"])
+        resp.headers["X-Page-Cache"] = state
+        return resp
+
+    def _compute(self, key, view):
+        resp = make_response(view())
+        if resp.status_code == 200 and not resp.direct_passthrough:
+            config = current_app.config
+            self.backend.set(key, {
+                "created": time.time(),
+                "status": resp.status_code,
+                "mimetype": resp.mimetype,
+                "body": resp.get_data(),
+            }, config["PAGE_CACHE_TTL"] + config["PAGE_CACHE_STALE_SECONDS"])
+        return resp
+
+    def serve(self, key, view):
+        config = current_app.config
+        entry = self.backend.get(key)
+
+        if entry is not None:
+            if time.time() - entry["created"] < config["PAGE_CACHE_TTL"]:
+                self._count("hits")
+                return self._respond(entry, "HIT")
+
+            if self.backend.acquire(key, self.LOCK_SECONDS):
+                @copy_current_request_context
+                def refresh():
+                    try:
+                        self._compute(key, view)
+                    finally:
+                        self.backend.release(key)
+
+                self._count("refreshes")
+                threading.Thread(target=refresh, daemon=True).start()
+            self._count("stale")
+            return self._respond(entry, "STALE")
+
+        if self.backend.acquire(key, self.LOCK_SECONDS):
+            self._count("misses")
+            try:
+                resp = self._compute(key, view)
+            finally:
+                self.backend.release(key)
+            resp.headers["X-Page-Cache"] = "MISS"
+            return resp
+
+        # another request is rendering this page: wait for its result
+        deadline = time.monotonic() + config["PAGE_CACHE_WAIT"]
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.backend.get(key)
+            if entry is not None:
+                self._count("coalesced")
+                return self._respond(entry, "COALESCED")
+
+        self._count("misses")
+        return make_response(view())
+
+
+page_cache = PageCache()
+
+
+def init_app(app):
+    page_cache.init_app(app)
+
+
+def cached_for_anonymous(*allowed_args):
+    """
+    Serves the view from the page cache for logged-out visitors. Requests carrying any
+    query argument outside `allowed_args` (search text, cursors, ...) bypass the cache.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if (not current_app.config["PAGE_CACHE_TTL"]
+                    or session.get("user_id")
+                    or any(k not in allowed_args for k in request.args)):
+                return fn(*args, **kwargs)
+
+            query = urlencode(sorted((k, request.args[k].strip().lower()) for k in allowed_args if request.args.get(k)))
+            key = f"page:{request.path}?{query}"
+            return page_cache.serve(key, lambda: fn(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -1,24 +1,285 @@
-from app.db import get_db_connection
-from flask import session
+import base64
+import re
+from datetime import datetime
+from app.db import get_db
+from flask import session, render_template, jsonify
 
-def get_votes(post_ids):
-    conn = get_db_connection()
-    cur = conn.cursor()
+PAGE_SIZE = 50
+
+# feed orderings without a search rank: ?sort= value -> timestamp column, newest first
+SORT_COLUMNS = {
+    "new": "p.created_at",
+    "active": "p.last_activity_at",
+}
+
+# feed orderings by a precomputed score, paged like search ranks: ?sort= value -> column
+SORT_RANKS = {
+    "hot": "p.hot_score",  # see app/ranking.py
+}
+
+FEED_SORTS = (*SORT_COLUMNS, *SORT_RANKS)
+
+POST_COLUMNS = """
+    p.id, p.title, p.created_at, u.username,
+    pm.media_type, pm.file_path, p.user_id, p.is_deleted, pm.status, p.card_version
+"""
+
+# tsvector kept in posts.search_tsv: title weighted above keyword names
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('simple', p.title), 'A')
+    || setweight(to_tsvector('simple', COALESCE((
+        SELECT string_agg(k.name, ' ')
+        FROM post_keywords pk
+        JOIN keywords k ON k.id = pk.keyword_id
+        WHERE pk.post_id = p.id
+    ), '')), 'B')
+"""
+
+def encode_cursor(created_at, post_id, rank=None) -> str:
+    raw = f"{created_at.isoformat()}|{post_id}"
+    if rank is not None:
+        raw += f"|{rank!r}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    Returns (created_at, post_id) - or (created_at, post_id, rank) for ranked search pages -
+    or None for a missing or malformed cursor, which callers treat as "first page".
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        parts = raw.split("|")
+        if len(parts) not in (2, 3):
+            return None
+        out = (datetime.fromisoformat(parts[0]), int(parts[1]))
+        if len(parts) == 3:
+            out += (float(parts[2]),)
+        return out
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def _page_query(sql, params, after, limit, rank=None, sort="new"):
+    """
+    Completes a listing query ordered by (sort column, p.id) DESC - see SORT_COLUMNS - or by
+    (rank, created_at, id) DESC when a rank expression is given. Returns (query, params).
+    `sql` has an {after} placeholder inside its WHERE clause; the keyset condition
+    lets the posts index seek straight to the page, so deep pages cost the same as page one.
+    """
+    params = list(params)
+    columns = POST_COLUMNS
+    order_by = "p.created_at DESC, p.id DESC"
+    after_sql = ""
+
+    if rank:
+        columns += f", {rank} AS rank"
+        order_by = f"{rank} DESC, " + order_by
+        if after and len(after) == 3:
+            after_sql = f"AND ({rank}, p.created_at, p.id) < (%s, %s, %s)"
+            params += [after[2], after[0], after[1]]
+    else:
+        sort_col = SORT_COLUMNS[sort]
+        order_by = f"{sort_col} DESC, p.id DESC"
+        if sort_col != "p.created_at":
+            # the cursor needs the sort value, which POST_COLUMNS does not carry
+            columns += f", {sort_col} AS sort_key"
+        if after and len(after) == 2:
+            after_sql = f"AND ({sort_col}, p.id) < (%s, %s)"
+            params += list(after)
+
+    query = sql.format(columns=columns, after=after_sql) + f"""
+        ORDER BY {order_by}
+        LIMIT %s
+    """
+    return query, (*params, limit)
+
+def _fetch_page(sql, params, after, limit, rank=None, sort="new"):
+    # one extra row tells us whether there is a next page
+    query, params = _page_query(sql, params, after, limit + 1, rank, sort)
+
+    cur = get_db().cursor()
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    cur.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if rank:
+            next_cursor = encode_cursor(last[2], last[0], last[-1])
+        elif SORT_COLUMNS[sort] != "p.created_at":
+            next_cursor = encode_cursor(last[-1], last[0])
+        else:
+            next_cursor = encode_cursor(last[2], last[0])
+    return rows, next_cursor
+
+def prefix_tsquery(q: str, max_terms: int = 8) -> str:
+    """
+    Turns free text into a to_tsquery() string where every word is a prefix match,
+    e.g. "funny ca" -> "funny:* & ca:*". Only word characters survive, so user input
+    can never inject tsquery operators.
+    """
+    terms = re.findall(r"\w+", q.lower())[:max_terms]
+    return " & ".join(f"{t}:*" for t in terms)
+
+def refresh_search_vector(cur, post_id: int):
+    cur.execute(f"""
+        UPDATE posts p
+        SET search_tsv = {SEARCH_VECTOR_SQL}
+        WHERE p.id = %s
+    """, (post_id,))
+
+def _sort_args(sort):
+    # keyword arguments for _fetch_page for one of FEED_SORTS
+    if sort in SORT_RANKS:
+        return {"rank": SORT_RANKS[sort]}
+    return {"sort": sort}
+
+def get_latest_posts(after=None, limit=PAGE_SIZE, sort="new"):
+    return _fetch_page("""
+        SELECT {columns}
+        FROM posts p
+        JOIN users u ON u.id = p.user_id
+        LEFT JOIN post_media pm ON pm.post_id = p.id
+        WHERE p.is_deleted = FALSE
+            {after}
+    """, (), after, limit, **_sort_args(sort))
+
+def _search_query(tsquery: str, tag: str):
+    """
+    Returns (sql, params, rank) for the feed search, to be completed by _page_query.
+    """
+    sql = """
+        SELECT {columns}
+        FROM posts p
+        JOIN users u ON u.id = p.user_id
+        LEFT JOIN post_media pm ON pm.post_id = p.id
+    """
+    where = ["p.is_deleted = FALSE"]
+    params = []
+    rank = None
+
+    if tsquery:
+        sql = "WITH query AS (SELECT to_tsquery('simple', %s) AS tsq)\n" + sql + "    CROSS JOIN query\n"
+        where.append("p.search_tsv @@ query.tsq")
+        params.append(tsquery)
+        rank = "ts_rank(p.search_tsv, query.tsq)::float8"
+
+    if tag:
+        # semi-join: at most one row per post, so no DISTINCT over a keyword fan-out;
+        # the keyword id is resolved once and probed through idx_post_keywords_keyword_id
+        where.append("""EXISTS (
+            SELECT 1
+            FROM post_keywords pk
+            WHERE pk.post_id = p.id
+                AND pk.keyword_id = (SELECT k.id FROM keywords k WHERE k.name = %s)
+        )""")
+        params.append(tag)
+
+    sql += " WHERE " + " AND ".join(where) + " {after}"
+    return sql, params, rank
+
+def search_posts(q: str, tag: str, after=None, limit=PAGE_SIZE, sort="new"):
+    """
+    Feed search. `q` is matched by prefix against the title and keyword names through the
+    GIN-indexed posts.search_tsv and ranked by relevance; `tag` is an exact keyword filter.
+    Without `q` the results follow `sort` (one of FEED_SORTS).
+    """
+    if not q and not tag:
+        return get_latest_posts(after, limit, sort)
+
+    tsquery = prefix_tsquery(q)
+    if q and not tsquery:
+        return [], None
+
+    sql, params, rank = _search_query(tsquery, tag)
+    if rank:
+        return _fetch_page(sql, params, after, limit, rank=rank)
+    return _fetch_page(sql, params, after, limit, **_sort_args(sort))
+
+def explain_search(cur, q: str, tag: str, limit=PAGE_SIZE):
+    """
+    EXPLAIN (FORMAT JSON) of the first page of search_posts(q, tag); returns the root plan node.
+    """
+    sql, params, rank = _search_query(prefix_tsquery(q), tag)
+    query, params = _page_query(sql, params, None, limit + 1, rank)
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    return cur.fetchone()[0][0]["Plan"]
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
 
+_INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Heap Scan")
+
+def feed_plan_problems(plan):
+    """
+    What is wrong with a /feed?tag= plan from explain_search, as a list of messages (empty when fine).
+    Wanted: post_keywords probed through an index and no sequential scan of posts or post_keywords.
+    The tag EXISTS may be planned as a semi-join or as a join over the de-duplicated post_keywords
+    matches (Unique/HashAggregate below the join); a de-duplicating node above posts is the
+    JOIN + DISTINCT fan-out coming back.
+    """
+    problems = []
+    keywords_by_index = False
+
+    for node in plan_nodes(plan):
+        kind = node["Node Type"]
+        rel = node.get("Relation Name")
+        if kind == "Seq Scan" and rel in ("posts", "post_keywords"):
+            problems.append(f"sequential scan on {rel}")
+        if kind in _INDEX_SCANS and rel == "post_keywords":
+            keywords_by_index = True
+        if kind in ("Unique", "Aggregate", "HashAggregate") and any(
+            n.get("Relation Name") == "posts" for n in plan_nodes(node)
+        ):
+            problems.append(f"{kind} over posts (row fan-out being de-duplicated)")
+
+    if not keywords_by_index:
+        problems.append("post_keywords is not read through an index")
+    return problems
+
+def get_user_posts(user_id: int, include_deleted: bool, after=None, limit=PAGE_SIZE):
+    return _fetch_page("""
+        SELECT {columns}
+        FROM posts p
+        JOIN users u ON u.id = p.user_id
+        LEFT JOIN post_media pm ON pm.post_id = p.id
+        WHERE p.user_id = %s
+            AND (p.is_deleted = FALSE OR %s = TRUE)
+            {after}
+    """, (user_id, include_deleted), after, limit)
+
+def feed_page_json(posts, next_url):
+    """
+    Infinite-scroll response: the rendered cards plus the URL of the following page.
+    """
+    post_ids = [p[0] for p in posts]
+    html = render_template(
+        "_feed_cards.html",
+        posts=posts,
+        keywords_by_post=get_keywords(post_ids),
+        vote_by_post=get_votes(post_ids),
+        activity_by_post=get_activity(post_ids),
+        variants_by_post=get_media_variants(post_ids),
+    )
+    return jsonify({"html": html, "next": next_url})
+
+def get_votes(post_ids):
     vote_by_post = {}
 
     if not post_ids:
         return vote_by_post
 
+    cur = get_db().cursor()
+
     cur.execute("""
-    SELECT
-        post_id,
-        SUM(CASE WHEN value = 1 THEN 1 ELSE 0 END) AS likes,
-        SUM(CASE WHEN value = -1 THEN 1 ELSE 0 END) AS dislikes,
-        COALESCE(SUM(value), 0) AS score
-    FROM post_votes
+    SELECT post_id, likes, dislikes, score
+    FROM post_vote_totals
     WHERE post_id IN %s
-    GROUP BY post_id
     """, (tuple(post_ids),))
 
     for post_id, likes, dislikes, score in cur.fetchall():
@@ -44,19 +305,67 @@ def get_votes(post_ids):
             vote_by_post[post_id]["user_vote"] = int(value)
 
     cur.close()
-    conn.close()
 
     return vote_by_post
 
-def get_keywords(post_ids):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def get_activity(post_ids):
+    """
+    {post_id: {"comments": n, "last_activity_at": ts}} from the counters on posts
+    (see trg_comments_activity in sql.txt), so listings never aggregate over comments.
+    """
+    activity_by_post = {}
+
+    if not post_ids:
+        return activity_by_post
+
+    cur = get_db().cursor()
+    cur.execute("""
+        SELECT id, comment_count, last_activity_at
+        FROM posts
+        WHERE id IN %s
+        """, (tuple(post_ids),))
+
+    for post_id, comment_count, last_activity_at in cur.fetchall():
+        activity_by_post[post_id] = {
+            "comments": int(comment_count or 0),
+            "last_activity_at": last_activity_at,
+        }
+
+    cur.close()
+
+    return activity_by_post
 
+def get_media_variants(post_ids):
+    """
+    {post_id: {"thumb": [(width, file_path), ...], "poster": [...]}}, narrowest first.
+    """
+    variants_by_post = {}
+
+    if not post_ids:
+        return variants_by_post
+
+    cur = get_db().cursor()
+    cur.execute("""
+        SELECT post_id, role, width, file_path
+        FROM post_media_variants
+        WHERE post_id IN %s
+        ORDER BY post_id, role, width
+        """, (tuple(post_ids),))
+
+    for post_id, role, width, file_path in cur.fetchall():
+        variants_by_post.setdefault(post_id, {}).setdefault(role, []).append((width, file_path))
+
+    cur.close()
+
+    return variants_by_post
+
+def get_keywords(post_ids):
     keywords_by_post = {}
     
     if not post_ids:
         return keywords_by_post
     
+    cur = get_db().cursor()
     cur.execute("""
         SELECT pk.post_id, k.name
         FROM post_keywords pk
@@ -69,6 +378,5 @@ def get_keywords(post_ids):
         keywords_by_post.setdefault(post_id, []).append(name)
 
     cur.close()
-    conn.close()
 
     return keywords_by_post
\ No newline at end of file
@@ -2,11 +2,19 @@ from flask import Blueprint
 from flask import render_template, request, redirect, url_for, session, abort, jsonify
 from flask import current_app, send_file
 from app.decorators import roles_required, login_required, permission_required
-from app.db import get_db_connection
-from app.uploads import save_upload_hardened
+from app.db import get_db
+from app.uploads import quarantine_upload, store_post_media
+from app.uploads import start_upload_session, append_upload_chunk, get_upload_session, claim_upload_session
 from app.security import user_has_permission, parse_keywords
+import mimetypes
 import os
-from app.post_helpers import get_votes, get_keywords
+import re
+import stat
+from app.cache import TTLCache
+from app.fragments import invalidate_card
+from app.page_cache import cached_for_anonymous
+from app.comment_helpers import get_comment_threads, get_comment_replies
+from app.post_helpers import get_votes, get_keywords, get_activity, get_media_variants, search_posts, FEED_SORTS, decode_cursor, feed_page_json, refresh_search_vector
 
 posts_bp = Blueprint("posts", __name__)
 
@@ -25,54 +33,111 @@ def new_post_post():
     if not title:
         return render_template("post_new.html", error="Title is required.")
 
+    conn = get_db()
+    cur = conn.cursor()
+
     media_info = None
-    if file and file.filename:
-        media_info = save_upload_hardened(file)
+    upload_id = request.form.get("upload_id")
+    if upload_id:
+        # file sent beforehand through a resumable upload session
+        media_info = claim_upload_session(cur, upload_id, session["user_id"])
+        if not media_info:
+            return render_template("post_new.html", error="Upload incomplete or expired.")
+    elif file and file.filename:
+        media_info = quarantine_upload(file)
         if not media_info:
             return render_template("post_new.html", error="Invalid or unsafe file.")
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
     cur.execute(
-        "INSERT INTO posts (user_id, title) VALUES (%s, %s) RETURNING id",
-        (session["user_id"], title)
+        """INSERT INTO posts (user_id, title, search_tsv)
+        VALUES (%s, %s, setweight(to_tsvector('simple', %s), 'A')) RETURNING id""",
+        (session["user_id"], title, title)
     )
     post_id = cur.fetchone()[0]
 
     if media_info:
-        stored_name = os.path.basename(media_info["file_path"])
-        cur.execute("""
-            INSERT INTO post_media (post_id, media_type, file_path, original_filename, mime_type, file_size_bytes)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
-            post_id,
-            media_info["media_type"],
-            stored_name,
-            media_info["original_filename"],
-            None, 
-            media_info["file_size_bytes"]
-        ))
+        store_post_media(cur, post_id, media_info)
 
     keywords = parse_keywords(request.form.get("keywords", ""))
     add_keywords_to_post(conn, post_id, keywords)
 
-    conn.commit()
     cur.close()
-    conn.close()
 
     return redirect(url_for("posts.view_post", post_id=post_id))
 
 
+@posts_bp.route("/uploads", methods=["POST"])
+@login_required
+def start_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        total = int(data.get("size"))
+    except (TypeError, ValueError):
+        abort(400)
+
+    cur = get_db().cursor()
+    upload_id = start_upload_session(cur, session["user_id"], data.get("filename"), total)
+    cur.close()
+    if not upload_id:
+        return jsonify({"error": "File type or size not allowed."}), 422
+
+    return jsonify({
+        "id": upload_id,
+        "url": url_for("posts.upload_chunk", upload_id=upload_id),
+        "chunk_bytes": current_app.config["UPLOAD_CHUNK_BYTES"],
+    }), 201
+
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)$")
+
+@posts_bp.route("/uploads/<upload_id>", methods=["PUT"])
+@login_required
+def upload_chunk(upload_id):
+    m = _CONTENT_RANGE.match(request.headers.get("Content-Range", ""))
+    if not m:
+        abort(400)
+    start, end = int(m.group(1)), int(m.group(2))
+
+    cur = get_db().cursor()
+    try:
+        received, total, error = append_upload_chunk(
+            cur, upload_id, session["user_id"], start, end - start + 1, request.stream
+        )
+    except LookupError:
+        cur.close()
+        abort(404)
+
+    if error in ("offset", "incomplete chunk"):
+        # 409 tells the client where to resume from
+        cur.close()
+        return jsonify({"received": received, "total": total, "error": error}), 409
+    if error:
+        cur.close()
+        return jsonify({"error": error}), 422
+
+    cur.close()
+    return jsonify({"received": received, "total": total, "complete": received == total})
+
+
+@posts_bp.route("/uploads/<upload_id>", methods=["GET"])
+@login_required
+def upload_status(upload_id):
+    cur = get_db().cursor()
+    row = get_upload_session(cur, upload_id, session["user_id"])
+    cur.close()
+    if not row:
+        abort(404)
+    return jsonify({"received": row[0], "total": row[1], "complete": row[0] == row[1]})
+
+
 @posts_bp.route("/posts/<int:post_id>", methods=["GET"])
 def view_post(post_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("""
         SELECT p.id, p.title, p.created_at, u.username, p.user_id,
             pm.media_type, pm.file_path,
-            p.is_deleted, p.deleted_at, du.username
+            p.is_deleted, p.deleted_at, du.username, pm.status, p.comment_count
         FROM posts p
         JOIN users u ON u.id = p.user_id
         LEFT JOIN post_media pm ON pm.post_id = p.id
@@ -82,34 +147,16 @@ def view_post(post_id):
     post = cur.fetchone()
 
     if not post:
-        cur.close()
-        conn.close()
         abort(404)
         
-    is_deleted = post[7]
-    owner_id = post[4]
-
-    if is_deleted:
-        viewer_id = session.get("user_id")
-        viewer_role = session.get("role")
-
-        if not viewer_id:
-            abort(404)
-
-        if viewer_id != owner_id and viewer_role != "admin":
-            if not user_has_permission(viewer_id, "delete_any_post"):
-                abort(404)
-    
+    _check_post_visible(owner_id=post[4], is_deleted=post[7])
 
     cur.execute("""
-        SELECT
-        COALESCE(SUM(value), 0) AS score,
-        COALESCE(SUM(CASE WHEN value = 1 THEN 1 ELSE 0 END), 0) AS likes,
-        COALESCE(SUM(CASE WHEN value = -1 THEN 1 ELSE 0 END), 0) AS dislikes
-        FROM post_votes
+        SELECT score, likes, dislikes
+        FROM post_vote_totals
         WHERE post_id = %s
     """, (post_id,))
-    score, likes, dislikes = cur.fetchone()
+    score, likes, dislikes = cur.fetchone() or (0, 0, 0)
 
     user_vote = 0
     if session.get("user_id"):
@@ -122,15 +169,7 @@ def view_post(post_id):
     else:
         user_vote = 0
 
-    cur.execute("""
-        SELECT c.id, c.parent_comment_id, c.body, c.created_at,
-            u.username, c.user_id
-        FROM comments c
-        JOIN users u ON u.id = c.user_id
-        WHERE c.post_id = %s AND c.is_deleted = FALSE
-        ORDER BY c.created_at ASC
-    """, (post_id,))
-    comments = cur.fetchall()
+    comments, comments_next = get_comment_threads(post_id)
 
     cur.execute("""
         SELECT k.name
@@ -142,7 +181,6 @@ def view_post(post_id):
     keywords = cur.fetchall()
 
     cur.close()
-    conn.close()
 
     return render_template(
         "post_detail.html",
@@ -150,23 +188,73 @@ def view_post(post_id):
         score=score, likes=likes, dislikes=dislikes,
         user_vote=user_vote,
         comments=comments,
-        keywords=keywords
+        comments_next=url_for("posts.comment_threads", post_id=post_id, after=comments_next) if comments_next else None,
+        keywords=keywords,
+        variants=get_media_variants([post_id]).get(post_id, {}),
     )
 
 
 
+# filename -> (abs_path, etag, mimetype), or False for a missing file. gc-media deletes files
+# from another process; a cached entry for a deleted file is dropped when sending it fails.
+_media_stat_cache = TTLCache(maxsize=4096)
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+def _media_info(filename):
+    cached = _media_stat_cache.get(filename)
+    if cached is not None:
+        return cached or None
+
+    ttl = current_app.config["MEDIA_STAT_CACHE_TTL"]
+    abs_path = os.path.abspath(os.path.join(current_app.config["UPLOAD_FOLDER"], filename))
+    try:
+        st = os.stat(abs_path)
+    except FileNotFoundError:
+        _media_stat_cache.set(filename, False, min(ttl, 5))
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    # content-addressed names already are the hash; older names are never rewritten, so
+    # size and mtime identify their content without reading the file
+    m = _CONTENT_ADDRESSED.match(filename)
+    etag = m.group(1) if m else f"{st.st_size:x}-{st.st_mtime_ns:x}"
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    info = (abs_path, etag, mimetype)
+    _media_stat_cache.set(filename, info, ttl)
+    return info
+
 @posts_bp.route("/media/<path:filename>", methods=["GET"])
 def media(filename):
     if "/" in filename or ".." in filename:
         abort(404)
 
-    abs_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
-    if not os.path.exists(abs_path):
+    info = _media_info(filename)
+    if not info:
         abort(404)
+    abs_path, etag, mimetype = info
+
+    if request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    elif current_app.config["MEDIA_SENDFILE"] == "x-accel":
+        # nginx serves the bytes (and Range requests) from its internal location
+        resp = current_app.response_class(mimetype=mimetype)
+        resp.headers["X-Accel-Redirect"] = current_app.config["MEDIA_ACCEL_PREFIX"] + filename
+    elif current_app.config["MEDIA_SENDFILE"] == "x-sendfile":
+        resp = current_app.response_class(mimetype=mimetype)
+        resp.headers["X-Sendfile"] = abs_path
+    else:
+        try:
+            resp = send_file(abs_path, mimetype=mimetype, conditional=True, etag=etag)
+        except FileNotFoundError:
+            _media_stat_cache.delete(filename)
+            abort(404)
 
-    resp = send_file(abs_path, conditional=True)
+    resp.set_etag(etag)
     resp.headers["X-Content-Type-Options"] = "nosniff"
-    resp.headers["Cache-Control"] = "public, max-age=86400"
+    # every stored name is unique to its content
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
     return resp
 
 @posts_bp.route("/posts/<int:post_id>/vote", methods=["POST"])
@@ -178,45 +266,70 @@ def vote_post(post_id):
     if v not in (1, -1):
         abort(400)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
-    # toggle behavior: same vote again => remove vote
-    cur.execute("""
-        SELECT value FROM post_votes
-        WHERE post_id=%s AND user_id=%s
-    """, (post_id, session["user_id"]))
-    row = cur.fetchone()
+    # toggle behavior: same vote again => remove vote (see toggle_post_vote in sql.txt)
+    cur.execute(
+        "SELECT score, likes, dislikes, user_vote FROM toggle_post_vote(%s, %s, %s::smallint)",
+        (post_id, session["user_id"], v)
+    )
+    score, likes, dislikes, user_vote = cur.fetchone()
+    invalidate_card(post_id)
 
-    if row and row[0] == v:
-        cur.execute("""
-            DELETE FROM post_votes
-            WHERE post_id=%s AND user_id=%s
-        """, (post_id, session["user_id"]))
-    else:
-        cur.execute("""
-            INSERT INTO post_votes (post_id, user_id, value)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (post_id, user_id)
-            DO UPDATE SET value = EXCLUDED.value, created_at = NOW()
-        """, (post_id, session["user_id"], v))
+    cur.close()
+    return jsonify({"score": score, "likes": likes, "dislikes": dislikes, "user_vote": user_vote})
 
-    conn.commit()
+def _check_post_visible(owner_id, is_deleted):
+    # deleted posts (and their comments) are only visible to the owner and moderators
+    if not is_deleted:
+        return
 
-    # return updated totals
-    cur.execute("""
-        SELECT
-          COALESCE(SUM(value), 0) AS score,
-          COALESCE(SUM(CASE WHEN value = 1 THEN 1 ELSE 0 END), 0) AS likes,
-          COALESCE(SUM(CASE WHEN value = -1 THEN 1 ELSE 0 END), 0) AS dislikes
-        FROM post_votes
-        WHERE post_id = %s
-    """, (post_id,))
-    score, likes, dislikes = cur.fetchone()
+    viewer_id = session.get("user_id")
+    viewer_role = session.get("role")
+
+    if not viewer_id:
+        abort(404)
 
+    if viewer_id != owner_id and viewer_role != "admin":
+        if not user_has_permission(viewer_id, "delete_any_post"):
+            abort(404)
+
+@posts_bp.route("/posts/<int:post_id>/comments", methods=["GET"])
+def comment_threads(post_id):
+    cur = get_db().cursor()
+    cur.execute("SELECT user_id, is_deleted FROM posts WHERE id = %s", (post_id,))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        abort(404)
+    _check_post_visible(*row)
+
+    comments, next_cursor = get_comment_threads(post_id, decode_cursor(request.args.get("after")))
+    return jsonify({
+        "html": render_template("_comments.html", comments=comments),
+        "next": url_for("posts.comment_threads", post_id=post_id, after=next_cursor) if next_cursor else None,
+    })
+
+@posts_bp.route("/comments/<int:comment_id>/replies", methods=["GET"])
+def comment_replies(comment_id):
+    cur = get_db().cursor()
+    cur.execute("""
+        SELECT p.user_id, p.is_deleted
+        FROM comments c
+        JOIN posts p ON p.id = c.post_id
+        WHERE c.id = %s AND c.is_deleted = FALSE
+    """, (comment_id,))
+    row = cur.fetchone()
     cur.close()
-    conn.close()
-    return jsonify({"score": score, "likes": likes, "dislikes": dislikes})
+    if not row:
+        abort(404)
+    _check_post_visible(*row)
+
+    replies, next_cursor = get_comment_replies(comment_id, decode_cursor(request.args.get("after")))
+    return jsonify({
+        "html": render_template("_comments.html", comments=replies),
+        "next": url_for("posts.comment_replies", comment_id=comment_id, after=next_cursor) if next_cursor else None,
+    })
 
 @posts_bp.route("/posts/<int:post_id>/comments", methods=["POST"])
 @login_required
@@ -234,14 +347,13 @@ def add_comment(post_id):
         except ValueError:
             abort(400)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     # If replying to a comment, ensure it belongs to same post
     if parent_id_int is not None:
         cur.execute("SELECT 1 FROM comments WHERE id=%s AND post_id=%s", (parent_id_int, post_id))
         if cur.fetchone() is None:
-            cur.close(); conn.close()
+            cur.close()
             abort(400)
 
     cur.execute("""
@@ -249,26 +361,63 @@ def add_comment(post_id):
         VALUES (%s, %s, %s, %s)
     """, (post_id, session["user_id"], parent_id_int, body))
 
-    conn.commit()
     cur.close()
-    conn.close()
+    return redirect(url_for("posts.view_post", post_id=post_id))
+
+@posts_bp.route("/comments/<int:comment_id>/delete", methods=["POST"])
+@login_required
+def delete_comment(comment_id):
+    cur = get_db().cursor()
+
+    cur.execute("SELECT post_id, user_id, is_deleted FROM comments WHERE id=%s", (comment_id,))
+    row = cur.fetchone()
+    if not row:
+        cur.close()
+        abort(404)
+
+    post_id, author_id, is_deleted = row
+    if is_deleted:
+        cur.close()
+        return redirect(url_for("posts.view_post", post_id=post_id))
+
+    viewer_id = session["user_id"]
+    viewer_role = session.get("role")
+
+    can_delete = (
+        viewer_id == author_id
+        or viewer_role == "admin"
+        or user_has_permission(viewer_id, "delete_any_comment")
+    )
+    if not can_delete:
+        cur.close()
+        abort(403)
+
+    # posts.comment_count follows through trg_comments_activity
+    cur.execute("""
+        UPDATE comments
+        SET is_deleted = TRUE,
+            deleted_by_user_id = %s
+        WHERE id = %s
+    """, (viewer_id, comment_id))
+
+    cur.close()
+
     return redirect(url_for("posts.view_post", post_id=post_id))
 
 @posts_bp.route("/posts/<int:post_id>/delete", methods=["POST"])
 @login_required
 def delete_post(post_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("SELECT user_id, is_deleted FROM posts WHERE id=%s", (post_id,))
     row = cur.fetchone()
     if not row:
-        cur.close(); conn.close()
+        cur.close()
         abort(404)
 
     owner_id, is_deleted = row
     if is_deleted:
-        cur.close(); conn.close()
+        cur.close()
         return redirect(url_for("posts.view_post", post_id=post_id))
 
     viewer_id = session["user_id"]
@@ -280,38 +429,37 @@ def delete_post(post_id):
         or user_has_permission(viewer_id, "delete_any_post")
     )
     if not can_delete:
-        cur.close(); conn.close()
+        cur.close()
         abort(403)
 
     cur.execute("""
         UPDATE posts
         SET is_deleted = TRUE,
             deleted_at = NOW(),
-            deleted_by_user_id = %s
+            deleted_by_user_id = %s,
+            card_version = card_version + 1
         WHERE id = %s
     """, (viewer_id, post_id))
+    invalidate_card(post_id)
 
-    conn.commit()
     cur.close()
-    conn.close()
 
     return redirect(url_for("posts.view_post", post_id=post_id))
 
 @posts_bp.route("/posts/<int:post_id>/recover", methods=["POST"])
 @permission_required("delete_any_post")
 def recover_post(post_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cur = get_db().cursor()
 
     cur.execute("SELECT user_id, is_deleted FROM posts WHERE id=%s", (post_id,))
     row = cur.fetchone()
     if not row:
-        cur.close(); conn.close()
+        cur.close()
         abort(404)
 
     owner_id, is_deleted = row
     if not is_deleted:
-        cur.close(); conn.close()
+        cur.close()
         return redirect(url_for("posts.view_post", post_id=post_id))
 
     viewer_id = session["user_id"]
@@ -322,20 +470,21 @@ def recover_post(post_id):
         or user_has_permission(viewer_id, "delete_any_post")
     )
     if not can_recover:
-        cur.close(); conn.close()
+        cur.close()
         abort(403)
 
     cur.execute("""
         UPDATE posts
         SET is_deleted = FALSE,
             deleted_at = NOW(),
-            deleted_by_user_id = %s
+            deleted_by_user_id = %s,
+            deleted_by_ban = FALSE,
+            card_version = card_version + 1
         WHERE id = %s
     """, (viewer_id, post_id))
+    invalidate_card(post_id)
 
-    conn.commit()
     cur.close()
-    conn.close()
 
     return redirect(url_for("posts.view_post", post_id=post_id))
 
@@ -357,50 +506,53 @@ def add_keywords_to_post(conn, post_id: int, keywords: list[str]):
             [(post_id, kid) for (kid, _name) in rows],
         )
 
+        # keyword names are searchable too
+        refresh_search_vector(cur, post_id)
+
+def _feed_sort():
+    sort = (request.args.get("sort") or "").strip().lower()
+    return sort if sort in FEED_SORTS else "new"
+
 @posts_bp.get("/feed")
+@cached_for_anonymous("tag", "sort")
 def feed():
     q = (request.args.get("q") or "").strip()
     tag = (request.args.get("tag") or "").strip().lower()
+    sort = _feed_sort()
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT DISTINCT
-            p.id, p.title, p.created_at, u.username,
-            pm.media_type, pm.file_path, p.user_id
-        FROM posts p
-        JOIN users u ON u.id = p.user_id
-        LEFT JOIN post_media pm ON pm.post_id = p.id
-        LEFT JOIN post_keywords pk ON pk.post_id = p.id
-        LEFT JOIN keywords k ON k.id = pk.keyword_id
-        WHERE
-            p.is_deleted = FALSE
-            AND (%s = '' OR k.name = %s)
-            AND (
-                %s = ''
-                OR p.title ILIKE concat('%%', %s, '%%')
-                OR k.name ILIKE concat('%%', %s, '%%')
-            )
-        ORDER BY p.created_at DESC
-        LIMIT 50
-    """, (tag, tag, q, q, q))
-
-    posts = cur.fetchall()
+    posts, next_cursor = search_posts(q, tag, decode_cursor(request.args.get("after")), sort=sort)
 
     post_ids = [p[0] for p in posts]
     keywords_by_post = get_keywords(post_ids)
     
     vote_by_post = get_votes(post_ids)
 
-    cur.close()
-    conn.close()
-
     return render_template(
         "feed.html",
         posts=posts,
         keywords_by_post=keywords_by_post,
         vote_by_post=vote_by_post,
+        activity_by_post=get_activity(post_ids),
+        variants_by_post=get_media_variants(post_ids),
         q=q,
-        tag=tag
+        tag=tag,
+        sort=sort,
+        next_url=_feed_url("posts.feed", q, tag, sort, next_cursor),
+        more_url=_feed_url("posts.feed_json", q, tag, sort, next_cursor),
     )
+
+@posts_bp.get("/feed.json")
+def feed_json():
+    q = (request.args.get("q") or "").strip()
+    tag = (request.args.get("tag") or "").strip().lower()
+    sort = _feed_sort()
+
+    posts, next_cursor = search_posts(q, tag, decode_cursor(request.args.get("after")), sort=sort)
+    return feed_page_json(posts, _feed_url("posts.feed_json", q, tag, sort, next_cursor))
+
+def _feed_url(endpoint, q, tag, sort, cursor):
+    if not cursor:
+        return None
+    # search results are ordered by relevance, so sort only travels without q
+    sort = None if q or sort == "new" else sort
+    return url_for(endpoint, q=q or None, tag=tag or None, sort=sort, after=cursor)
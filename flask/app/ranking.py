@@ -0,0 +1,61 @@
+import json
+
+from app.jobs import register_job
+
+# /feed?sort=hot reads posts.hot_score through idx_posts_hot. The score is Reddit's "hot"
+# (post_hot_score in sql.txt): log10 of the vote score plus the post's age in 12.5 hour
+# steps, so a day of age is worth almost a 100x score difference (86400 / 45000 = 1.92
+# against log10(100) = 2). Writing it on every vote would rewrite the posts row and every
+# index on it, so toggle_post_vote only touches post_vote_totals and the
+# recurring refresh_hot_scores job copies changed scores onto the posts of the last
+# HOT_SCORE_WINDOW_DAYS every HOT_SCORE_REFRESH_SECONDS. Each run rewrites only the posts
+# voted on since the last one, however many votes they got. Older posts keep their last
+# score, which their age already outweighs.
+
+REFRESH_JOB = "refresh_hot_scores"
+
+
+def refresh_hot_scores(cur, window_days: int) -> int:
+    """Recomputes hot_score for posts created in the last `window_days`; returns rows changed."""
+    cur.execute("""
+        UPDATE posts p
+        SET hot_score = h.hot_score
+        FROM (
+            SELECT p2.id, post_hot_score(COALESCE(t.score, 0), p2.created_at) AS hot_score
+            FROM posts p2
+            LEFT JOIN post_vote_totals t ON t.post_id = p2.id
+            WHERE p2.created_at >= NOW() - make_interval(days => %s)
+        ) h
+        WHERE p.id = h.id
+            AND p.hot_score IS DISTINCT FROM h.hot_score
+    """, (window_days,))
+    return cur.rowcount
+
+
+def schedule_refresh(cur, window_days: int, interval_seconds: int) -> bool:
+    """Queues the recurring refresh job unless one is already waiting; returns whether it did."""
+    cur.execute("""
+        INSERT INTO jobs (kind, payload)
+        SELECT %s, %s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM jobs WHERE kind = %s AND status IN ('pending', 'running')
+        )
+    """, (REFRESH_JOB, json.dumps({"window_days": window_days, "interval_seconds": interval_seconds}), REFRESH_JOB))
+    return cur.rowcount == 1
+
+
+def _run_refresh(payload):
+    # nothing to do off the database; the UPDATE runs in _finish_refresh
+    return None
+
+
+def _finish_refresh(cur, payload, _result):
+    refresh_hot_scores(cur, payload["window_days"])
+    # queue the next run; this row is marked done in the same transaction
+    cur.execute("""
+        INSERT INTO jobs (kind, payload, run_after)
+        VALUES (%s, %s, NOW() + make_interval(secs => %s))
+    """, (REFRESH_JOB, json.dumps(payload), payload["interval_seconds"]))
+
+
+register_job(REFRESH_JOB, _run_refresh, _finish_refresh)
@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+try:
+    import redis
+except ImportError:  # optional: only needed for RATE_LIMIT_BACKEND = "redis"
+    redis = None
+
+
+class MemoryBucketBackend:
+    """
+    Per-process token buckets in a bounded LRU dict: at most `max_keys` buckets are kept,
+    the least recently used one is dropped first (which only resets it to a full bucket).
+    """
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class RedisBucketBackend:
+    """Buckets shared by every worker process, on Redis or a compatible server (valkey in compose.yaml)."""
+
+    # KEYS[1] bucket; ARGV capacity, tokens per second. Returns {allowed, tokens * 1000}.
+    _TAKE = """
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, math.floor(tokens * 1000)}
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the 'redis' package")
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self._TAKE)
+
+    def take(self, key, capacity, rate):
+        allowed, millitokens = self._take(keys=[key], args=[capacity, rate])
+        tokens = millitokens / 1000
+        return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+
+class RateLimiter:
+    """
+    Token buckets for the auth endpoints. Each rule in RATE_LIMITS allows a burst of
+    `capacity` attempts, refilled evenly over `period` seconds; keys stay bounded in memory
+    whatever the number of distinct clients.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self._stats = {"allowed": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config["RATE_LIMIT_BACKEND"] == "redis":
+            self.backend = RedisBucketBackend(app.config["RATE_LIMIT_REDIS_URL"])
+        else:
+            self.backend = MemoryBucketBackend(app.config["RATE_LIMIT_MAX_KEYS"])
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def hit(self, key, capacity, period):
+        """Takes one token from bucket `key`; returns seconds to wait, or 0 when allowed."""
+        allowed, retry_after = self.backend.take(key, capacity, capacity / period)
+        self._count("allowed" if allowed else "rejected")
+        return retry_after
+
+
+limiter = RateLimiter()
+
+
+def init_app(app):
+    limiter.init_app(app)
+
+
+def rate_limited(rule, field=None, methods=("POST",)):
+    """
+    Charges the client IP's bucket under RATE_LIMITS[rule]["ip"] and, when `field` names a
+    form or query value (username, email), that value's bucket under RATE_LIMITS[rule]["account"].
+    Runs before the view, so a rejected attempt costs no database query, bcrypt hash or email.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            limits = current_app.config["RATE_LIMITS"].get(rule)
+            if not limits or request.method not in methods:
+                return fn(*args, **kwargs)
+
+            keys = [("ip", request.remote_addr or "-")]
+            value = (request.values.get(field) or "").strip().lower()[:254] if field else ""
+            if value:
+                keys.append(("account", value))
+
+            for scope, ident in keys:
+                if scope not in limits:
+                    continue
+                retry_after = limiter.hit(f"rl:{rule}:{scope}:{ident}", *limits[scope])
+                if retry_after:
+                    raise TooManyRequests(
+                        "Too many attempts. Please wait a moment and try again.",
+                        retry_after=math.ceil(retry_after),
+                    )
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,19 +1,69 @@
 import bcrypt
 import re
-from app.db import get_db_connection
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from app.db import get_db, call_after_commit
+from app.cache import TTLCache
 from urllib.parse import urlparse, urljoin
-from flask import request
+from flask import request, g, current_app, abort
 
 
 password_pattern = r'^(?=.*[A-Z])(?=.*[0-9])(?=.*[!@#$%^&*(),.?":{}|<>]).{8,}$'
 username_pattern = r'^[A-Za-z0-9_]{3,}$'
 email_pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
 
+_hasher_lock = threading.Lock()
+
+def _password_hasher(app):
+    # (executor, slots): one slot per hash running or queued on the executor
+    hasher = app.extensions.get("password_hasher")
+    if hasher is None:
+        with _hasher_lock:
+            hasher = app.extensions.get("password_hasher")
+            if hasher is None:
+                workers = app.config["BCRYPT_MAX_CONCURRENCY"]
+                hasher = (
+                    ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt"),
+                    threading.BoundedSemaphore(workers + app.config["BCRYPT_MAX_QUEUE"]),
+                )
+                app.extensions["password_hasher"] = hasher
+    return hasher
+
+def _run_bcrypt(fn, *args):
+    """
+    Runs a bcrypt call on the app's bounded hashing executor, so at most
+    BCRYPT_MAX_CONCURRENCY hashes burn CPU at once however many requests are logging in,
+    and at most BCRYPT_MAX_QUEUE more wait behind them. A request that finds no free slot
+    within BCRYPT_QUEUE_TIMEOUT seconds gets a 503 before its hash is queued; once queued,
+    it waits for the result however long the queue ahead of it takes.
+    """
+    executor, slots = _password_hasher(current_app._get_current_object())
+    if not slots.acquire(timeout=current_app.config["BCRYPT_QUEUE_TIMEOUT"]):
+        abort(503)
+
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _f: slots.release())
+    return future.result()
+
 def hash_password(pw):
-    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
+    rounds = current_app.config["BCRYPT_ROUNDS"]
+    return _run_bcrypt(lambda: bcrypt.hashpw(pw.encode(), bcrypt.gensalt(rounds)).decode())
 
 def check_password(pw, stored):
-    return bcrypt.checkpw(pw.encode(), stored.encode())
+    return _run_bcrypt(bcrypt.checkpw, pw.encode(), stored.encode())
+
+def password_needs_rehash(stored) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        cost = int(stored.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+    return cost != current_app.config["BCRYPT_ROUNDS"]
 
 def is_valid_email(email: str) -> bool:
     return bool(re.match(email_pattern, email))
@@ -24,22 +74,102 @@ def is_valid_username(username: str) -> bool:
 def is_valid_password(password: str) -> bool:
     return bool(re.match(password_pattern, password))
 
+_permissions_cache = TTLCache()
+
+def get_user_permissions(user_id: int) -> frozenset:
+    """
+    Permission keys granted to user_id, loaded at most once per request
+    and shared between requests for PERMISSIONS_CACHE_TTL seconds.
+    """
+    if user_id is None:
+        return frozenset()
+
+    loaded = g.setdefault("_user_permissions", {})
+    if user_id in loaded:
+        return loaded[user_id]
+
+    ttl = current_app.config.get("PERMISSIONS_CACHE_TTL", 0)
+    perms = _permissions_cache.get(user_id) if ttl > 0 else None
+
+    if perms is None:
+        cur = get_db().cursor()
+        cur.execute("""
+            SELECT permission_key
+            FROM user_permissions
+            WHERE user_id = %s
+        """, (user_id,))
+        perms = frozenset(r[0] for r in cur.fetchall())
+        cur.close()
+        if ttl > 0:
+            _permissions_cache.set(user_id, perms, ttl)
+
+    loaded[user_id] = perms
+    return perms
+
+def invalidate_user_permissions(user_id: int):
+    g.get("_user_permissions", {}).pop(user_id, None)
+    _permissions_cache.delete(user_id)
+    call_after_commit(lambda: _permissions_cache.delete(user_id))
+
+UserStatus = namedtuple("UserStatus", "role is_blocked is_activated version")
+
+# user_id -> UserStatus; versions come from users.status_version, bumped on every change
+_status_cache = TTLCache()
+_status_lock = threading.Lock()
+
+def _store_user_status(user_id: int, status: UserStatus, ttl: int):
+    # an older version (e.g. a reload that raced an admin change) never replaces a newer one
+    with _status_lock:
+        cached = _status_cache.get(user_id)
+        if cached is None or cached.version <= status.version:
+            _status_cache.set(user_id, status, ttl)
+
+def get_user_status(user_id: int):
+    """
+    UserStatus for user_id, or None if the account no longer exists. Read from the database
+    at most once per USER_STATUS_CACHE_TTL seconds per process; admin changes made through
+    set_user_status take effect at once.
+    """
+    loaded = g.setdefault("_user_status", {})
+    if user_id in loaded:
+        return loaded[user_id]
+
+    ttl = current_app.config["USER_STATUS_CACHE_TTL"]
+    status = _status_cache.get(user_id) if ttl > 0 else None
+
+    if status is None:
+        cur = get_db().cursor()
+        cur.execute("""
+            SELECT role, is_blocked, is_activated, status_version
+            FROM users
+            WHERE id = %s
+        """, (user_id,))
+        row = cur.fetchone()
+        cur.close()
+        if row is not None:
+            status = UserStatus(row[0], bool(row[1]), bool(row[2]), row[3])
+            if ttl > 0:
+                _store_user_status(user_id, status, ttl)
+
+    loaded[user_id] = status
+    return status
+
+def set_user_status(user_id: int, role, is_blocked, is_activated, version):
+    """
+    Records a status change made in the current transaction, from an UPDATE ... RETURNING
+    that bumped users.status_version. Visible to this request now, to the process cache on commit.
+    """
+    status = UserStatus(role, bool(is_blocked), bool(is_activated), version)
+    g.setdefault("_user_status", {})[user_id] = status
+    ttl = current_app.config["USER_STATUS_CACHE_TTL"]
+    if ttl > 0:
+        call_after_commit(lambda: _store_user_status(user_id, status, ttl))
+
 def user_has_permission(user_id: int, permission_key: str) -> bool:
     if user_id is None:
         return False
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT 1
-        FROM user_permissions
-        WHERE user_id = %s AND permission_key = %s
-        LIMIT 1
-    """, (user_id, permission_key))
-    ok = cur.fetchone() is not None
-    cur.close()
-    conn.close()
-    return ok
+    return permission_key in get_user_permissions(user_id)
 
 
 def parse_keywords(raw: str, max_keywords: int = 10):
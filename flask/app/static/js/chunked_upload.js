@@ -0,0 +1,85 @@
+// Resumable upload for big files on the new-post form: the file is sent in
+// Content-Range chunks to /uploads/<id>, resuming from the server's offset after
+// a failure, and the form is then submitted with upload_id instead of the file.
+$(function () {
+  const $form = $("form[data-upload-url]");
+  if (!$form.length) return;
+
+  const threshold = Number($form.data("chunked-threshold"));
+
+  function putChunk(url, file, start, size) {
+    const end = Math.min(start + size, file.size);
+    return $.ajax({
+      url: url,
+      method: "PUT",
+      processData: false,
+      contentType: "application/octet-stream",
+      headers: { "Content-Range": "bytes " + start + "-" + (end - 1) + "/" + file.size },
+      data: file.slice(start, end)
+    });
+  }
+
+  function sendFrom(url, file, start, size, retries, onProgress) {
+    if (start >= file.size) return $.Deferred().resolve().promise();
+
+    return putChunk(url, file, start, size).then(
+      function (r) {
+        onProgress(r.received / file.size);
+        return sendFrom(url, file, r.received, size, 5, onProgress);
+      },
+      function (xhr) {
+        if (xhr.status === 409 && xhr.responseJSON) {
+          return sendFrom(url, file, xhr.responseJSON.received, size, retries, onProgress);
+        }
+        if (xhr.status === 0 || xhr.status >= 500) {
+          if (retries <= 0) return $.Deferred().reject(xhr).promise();
+          // ask the server how far it got, then carry on from there
+          return $.Deferred(function (d) {
+            setTimeout(function () {
+              $.getJSON(url)
+                .then(function (s) { return sendFrom(url, file, s.received, size, retries - 1, onProgress); },
+                      function () { return sendFrom(url, file, start, size, retries - 1, onProgress); })
+                .then(d.resolve, d.reject);
+            }, 2000);
+          }).promise();
+        }
+        return $.Deferred().reject(xhr).promise();
+      }
+    );
+  }
+
+  $form.on("submit", function (e) {
+    const input = $form.find("input[type=file][name=media]")[0];
+    const file = input && input.files[0];
+    if (!file || file.size < threshold || $form.data("uploading")) return;
+
+    e.preventDefault();
+    $form.data("uploading", true);
+    const $btn = $form.find("button").prop("disabled", true);
+    const $bar = $form.find(".uploadProgress").removeClass("d-none").find(".progress-bar");
+    const $err = $form.find(".uploadError").addClass("d-none");
+
+    $.ajax({
+      url: $form.data("upload-url"),
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({ filename: file.name, size: file.size })
+    })
+      .then(function (s) {
+        return sendFrom(s.url, file, 0, s.chunk_bytes, 5, function (p) {
+          $bar.css("width", Math.round(p * 100) + "%");
+        }).then(function () { return s.id; });
+      })
+      .done(function (id) {
+        $form.find("input[name=upload_id]").val(id);
+        input.value = "";
+        $form.off("submit")[0].submit();
+      })
+      .fail(function (xhr) {
+        const msg = (xhr && xhr.responseJSON && xhr.responseJSON.error) || "Upload failed.";
+        $err.text(msg).removeClass("d-none");
+        $btn.prop("disabled", false);
+        $form.data("uploading", false);
+      });
+  });
+});
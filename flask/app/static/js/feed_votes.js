@@ -62,4 +62,36 @@ $(function () {
     const href = $(this).data("href");
     if (href) window.location = href;
   });
+
+  // INFINITE SCROLL (the "Load more" link's href is the no-JS fallback)
+  function loadMore($link) {
+    const url = $link.data("more-url");
+    if (!url || $link.data("loading")) return;
+    $link.data("loading", true);
+
+    $.getJSON(url)
+      .done(function (r) {
+        $(".feedCards").append(r.html);
+        if (r.next) {
+          $link.data("more-url", r.next);
+        } else {
+          $link.parent().remove();
+        }
+      })
+      .always(function () {
+        $link.data("loading", false);
+      });
+  }
+
+  $(document).on("click", ".feedMore", function (e) {
+    e.preventDefault();
+    loadMore($(this));
+  });
+
+  const $more = $(".feedMore");
+  if ($more.length && "IntersectionObserver" in window) {
+    new IntersectionObserver(function (entries) {
+      if (entries.some(function (en) { return en.isIntersecting; })) loadMore($more);
+    }, { rootMargin: "400px" }).observe($more[0]);
+  }
 });
@@ -1,8 +1,15 @@
+import hashlib
+import json
 import os
 import secrets
+import shutil
+import subprocess
+import tempfile
 from werkzeug.utils import secure_filename
-from flask import current_app
+from flask import current_app, Request
 from PIL import Image, ImageOps
+from app.db import call_after_commit
+from app.jobs import PermanentJobError, enqueue_job, register_job
 
 def _starts_with(data: bytes, sig: bytes) -> bool:
     return data[:len(sig)] == sig
@@ -35,150 +42,633 @@ def media_type_from_kind(kind: str) -> str:
         return "gif"
     return "video"
 
-def save_upload_hardened(file_storage):
+class MediaRejected(PermanentJobError):
+    """The upload failed validation; retrying will not help."""
+
+
+def _allowed_kinds(config) -> set[str]:
+    allowed = config["ALLOWED_IMAGE_EXT"] | config["ALLOWED_GIF_EXT"] | config["ALLOWED_VIDEO_EXT"]
+    return {k for k in ("png", "jpg", "webp", "gif", "mp4", "webm") if k in allowed}
+
+def _max_bytes_for(config, kind: str) -> int:
+    if media_type_from_kind(kind) == "video":
+        return config["MAX_VIDEO_UPLOAD_BYTES"]
+    # images and GIFs arrive in one request body, so the request limit is theirs too
+    return config["MAX_CONTENT_LENGTH"]
+
+
+class IngestStream:
     """
-    Returns dict with:
-      file_path (absolute path), kind, media_type, original_filename, file_size_bytes
-    or None on rejection.
+    Sink for uploaded files while Werkzeug parses the multipart body (see UploadRequest).
+    Bytes go straight into a temp file in QUARANTINE_FOLDER and are hashed on the way in;
+    the type is sniffed from the first bytes, and once the upload is known to be unacceptable
+    (unknown type or over the size limit) the file is dropped and the rest is discarded.
     """
-    original = (file_storage.filename or "").strip()
-    if not original:
-        return None
 
-    max_bytes = current_app.config.get("MAX_UPLOAD_BYTES", 25 * 1024 * 1024)  # 25MB
-    cl = getattr(file_storage, "content_length", None)
-    if cl is not None and cl > max_bytes:
-        return None
+    HEAD_BYTES = 16
+
+    def __init__(self, folder, allowed_kinds, config):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix=".ingest-")
+        self._file = os.fdopen(fd, "w+b")
+        self._allowed = allowed_kinds
+        self._config = config
+        self._head = b""
+        self._sha = hashlib.sha256()
+        self.size = 0
+        self.kind = None
+        self.rejected = None
+
+    def write(self, data):
+        if self.rejected:
+            return len(data)
+
+        if self.kind is None and len(self._head) < self.HEAD_BYTES:
+            self._head += data[:self.HEAD_BYTES - len(self._head)]
+            if len(self._head) >= self.HEAD_BYTES:
+                self._sniff()
+
+        self.size += len(data)
+        if self.size > _max_bytes_for(self._config, self.kind or "png"):
+            self._reject("file too large")
+        if self.rejected:
+            return len(data)
+
+        self._sha.update(data)
+        self._file.write(data)
+        return len(data)
+
+    def _sniff(self):
+        self.kind = sniff_kind(self._head)
+        if self.kind not in self._allowed:
+            self._reject("unsupported file type")
+
+    def _reject(self, reason):
+        self.rejected = reason
+        self._discard()
 
+    def _discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
-    # extension allowlist 
+    @property
+    def sha256(self):
+        return self._sha.hexdigest()
+
+    def finish(self):
+        """Sniffs uploads shorter than HEAD_BYTES; call once parsing is done."""
+        if self.kind is None and not self.rejected:
+            self._sniff()
+
+    def claim(self, dest_path):
+        """Moves the upload to its quarantine name; it is no longer deleted on close()."""
+        self._file.close()
+        os.replace(self.path, dest_path)
+        self.path = None
+
+    # Werkzeug seeks back to the start after writing; FileStorage reads through these.
+    # Once the data is dropped or claimed the stream reads as empty.
+    def seek(self, *args):
+        return 0 if self._file.closed else self._file.seek(*args)
+
+    def tell(self):
+        return 0 if self._file.closed else self._file.tell()
+
+    def read(self, *args):
+        return b"" if self._file.closed else self._file.read(*args)
+
+    def readline(self, *args):
+        return b"" if self._file.closed else self._file.readline(*args)
+
+    def close(self):
+        if self.path is not None:
+            self._discard()
+            self.path = None
+
+
+class UploadRequest(Request):
+    """Request class that streams uploaded files into IngestStream instead of a spooled temp file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        config = current_app.config
+        return IngestStream(config["QUARANTINE_FOLDER"], _allowed_kinds(config), config)
+
+
+def _check_extension(original: str):
+    """Returns (base name, extension) for an allowlisted filename, otherwise None."""
     safe_name = secure_filename(original)
     if "." not in safe_name:
         return None
-    ext = safe_name.rsplit(".", 1)[1].lower()
+    base, ext = safe_name.rsplit(".", 1)
+    ext = ext.lower()
 
     allowed = (current_app.config["ALLOWED_IMAGE_EXT"]
                | current_app.config["ALLOWED_GIF_EXT"]
                | current_app.config["ALLOWED_VIDEO_EXT"])
     if ext not in allowed:
         return None
+    return secure_filename(base)[:40] or "upload", ext
 
-    # read header to sniff actual file type
-    head = file_storage.stream.read(4096)
-    file_storage.stream.seek(0)
+def _quarantine_name(base: str, kind: str) -> str:
+    return f"{base}_{secrets.token_hex(16)}.{kind}"
 
-    kind = sniff_kind(head)
-    if not kind:
+def quarantine_upload(file_storage):
+    """
+    Cheap request-side checks (extension allowlist, magic-byte sniff, size) that leave the
+    upload in QUARANTINE_FOLDER. Decoding and re-encoding happen later in the
+    process_media job. Returns dict with:
+      quarantine_path (absolute path), file_path (name inside QUARANTINE_FOLDER), kind,
+      media_type, original_filename, file_size_bytes, source_sha256 (None when not known yet)
+    or None on rejection.
+    """
+    original = (file_storage.filename or "").strip()
+    if not original:
         return None
 
-    # enforce that sniffed kind matches allowed sets
-    if kind in {"png", "jpg", "webp"} and kind not in current_app.config["ALLOWED_IMAGE_EXT"]:
+    checked = _check_extension(original)
+    if not checked:
         return None
-    if kind == "gif" and kind not in current_app.config["ALLOWED_GIF_EXT"]:
+    base, _ext = checked
+
+    quarantine_dir = current_app.config["QUARANTINE_FOLDER"]
+    stream = file_storage.stream
+
+    if isinstance(stream, IngestStream):
+        # already on disk, sniffed and hashed while the body was parsed
+        stream.finish()
+        if stream.rejected:
+            return None
+        kind = stream.kind
+        out_name = _quarantine_name(base, kind)
+        quarantine_path = os.path.abspath(os.path.join(quarantine_dir, out_name))
+        stream.claim(quarantine_path)
+        size, sha = stream.size, stream.sha256
+    else:
+        kind = sniff_kind(stream.read(4096))
+        stream.seek(0)
+        if kind not in _allowed_kinds(current_app.config):
+            return None
+
+        os.makedirs(quarantine_dir, exist_ok=True)
+        out_name = _quarantine_name(base, kind)
+        quarantine_path = os.path.abspath(os.path.join(quarantine_dir, out_name))
+        file_storage.save(quarantine_path)
+
+        size = os.path.getsize(quarantine_path)
+        if size > _max_bytes_for(current_app.config, kind):
+            os.remove(quarantine_path)
+            return None
+        sha = sha256_file(quarantine_path)
+
+    return {
+        "quarantine_path": quarantine_path,
+        "file_path": out_name,
+        "kind": kind,
+        "media_type": media_type_from_kind(kind),
+        "original_filename": original,
+        "file_size_bytes": size,
+        "source_sha256": sha,
+    }
+
+
+# Resumable uploads: the client opens an upload_sessions row, PUTs the file in
+# Content-Range chunks (resuming from received_bytes after a dropped connection),
+# then submits the new-post form with the session id instead of a file.
+
+def _session_part_path(upload_id: str) -> str:
+    return os.path.abspath(os.path.join(current_app.config["QUARANTINE_FOLDER"], f"{upload_id}.part"))
+
+def start_upload_session(cur, user_id: int, filename: str, total_bytes: int):
+    """Returns the new session id, or None when the file cannot be accepted."""
+    original = (filename or "").strip()
+    if not original or not _check_extension(original):
         return None
-    if kind in {"mp4", "webm"} and kind not in current_app.config["ALLOWED_VIDEO_EXT"]:
+    if total_bytes <= 0 or total_bytes > current_app.config["MAX_VIDEO_UPLOAD_BYTES"]:
         return None
 
-    upload_dir = current_app.config["UPLOAD_FOLDER"]
-    os.makedirs(upload_dir, exist_ok=True)
+    upload_id = secrets.token_hex(16)
+    os.makedirs(current_app.config["QUARANTINE_FOLDER"], exist_ok=True)
+    open(_session_part_path(upload_id), "wb").close()
 
-    rnd = secrets.token_hex(16)
-    base = secure_filename(safe_name.rsplit(".", 1)[0])[:40] or "upload"
-    out_name = f"{base}_{rnd}.{kind}"
-    abs_path = os.path.join(upload_dir, out_name)
+    cur.execute("""
+        INSERT INTO upload_sessions (id, user_id, original_filename, total_bytes)
+        VALUES (%s, %s, %s, %s)
+    """, (upload_id, user_id, original, total_bytes))
+    return upload_id
 
-    # re-encode (strips metadata)
-    if kind in {"png", "jpg", "webp"}:
-        return _save_reencoded_image(file_storage, abs_path, kind, original)
+def append_upload_chunk(cur, upload_id: str, user_id: int, start: int, length: int, stream):
+    """
+    Writes one chunk at offset `start`. Returns (received_bytes, total_bytes, error) where
+    error is None, "offset" (start does not match what the server has), "incomplete chunk"
+    or a rejection reason; a rejected upload's data is deleted, which ends the session.
+    Raises LookupError for an unknown, expired or rejected session.
+    """
+    cur.execute("""
+        SELECT received_bytes, total_bytes, kind
+        FROM upload_sessions
+        WHERE id = %s AND user_id = %s AND expires_at > NOW()
+        FOR UPDATE
+    """, (upload_id, user_id))
+    row = cur.fetchone()
+    if not row:
+        raise LookupError(upload_id)
 
-    elif kind == "gif":
-        if not validate_gif_limits(file_storage):
-            return None
-        file_storage.stream.seek(0)
-        file_storage.save(abs_path)
+    received, total, kind = row
+    part_path = _session_part_path(upload_id)
+    if not os.path.exists(part_path):
+        raise LookupError(upload_id)
+    if start != received:
+        return received, total, "offset"
+    if length <= 0 or start + length > total:
+        return received, total, "chunk outside the declared size"
 
-    # GIF / video, stored normally
-    else:
-        file_storage.save(abs_path)
+    data = b""
+    if kind is None:
+        # first chunk: sniff the type before anything is stored
+        want = min(IngestStream.HEAD_BYTES, total)
+        if length < want:
+            return received, total, "first chunk too small"
+        while len(data) < want:
+            more = stream.read(want - len(data))
+            if not more:
+                return received, total, "incomplete chunk"
+            data += more
 
-    size = os.path.getsize(abs_path)
-    if size > max_bytes:
-        os.remove(abs_path)
+        kind = sniff_kind(data)
+        rejected = None
+        if kind not in _allowed_kinds(current_app.config):
+            rejected = "unsupported file type"
+        elif total > _max_bytes_for(current_app.config, kind):
+            rejected = "file too large"
+        if rejected:
+            os.remove(part_path)
+            return received, total, rejected
+
+    with open(part_path, "r+b") as f:
+        f.seek(start)
+        f.write(data)
+        remaining = length - len(data)
+        while remaining:
+            data = stream.read(min(remaining, 64 * 1024))
+            if not data:
+                break
+            f.write(data)
+            remaining -= len(data)
+
+    if remaining:
+        # connection dropped mid-chunk: keep the old offset, the client resends this chunk
+        return received, total, "incomplete chunk"
+
+    received += length
+    cur.execute("""
+        UPDATE upload_sessions
+        SET received_bytes = %s, kind = %s
+        WHERE id = %s
+    """, (received, kind, upload_id))
+    return received, total, None
+
+def get_upload_session(cur, upload_id: str, user_id: int):
+    cur.execute("""
+        SELECT received_bytes, total_bytes
+        FROM upload_sessions
+        WHERE id = %s AND user_id = %s AND expires_at > NOW()
+    """, (upload_id, user_id))
+    return cur.fetchone()
+
+def claim_upload_session(cur, upload_id: str, user_id: int):
+    """
+    Turns a fully received upload session into the same dict quarantine_upload returns.
+    The .part file is used where it is: deleting the session row is the only change, so a
+    request that rolls back leaves a session that can still be claimed. The source hash is
+    left to the process_media job rather than read over the whole file here.
+    """
+    cur.execute("""
+        DELETE FROM upload_sessions
+        WHERE id = %s AND user_id = %s AND received_bytes = total_bytes AND expires_at > NOW()
+        RETURNING original_filename, total_bytes, kind
+    """, (upload_id, user_id))
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    original, size, kind = row
+    part_path = _session_part_path(upload_id)
+    if not os.path.exists(part_path):
         return None
 
     return {
-        "file_path": abs_path,
+        "quarantine_path": part_path,
+        "file_path": os.path.basename(part_path),
         "kind": kind,
         "media_type": media_type_from_kind(kind),
         "original_filename": original,
         "file_size_bytes": size,
+        "source_sha256": None,
     }
 
-def _save_reencoded_image(file_storage, abs_path: str, kind: str, original: str):
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def process_media(src_path: str, dest_path: str, kind: str, max_bytes: int) -> int:
+    """
+    Validates and re-encodes a quarantined upload into dest_path; returns its size in bytes.
+    Derivatives are made separately (make_variants) once the file has its final name.
+    Pure function of its arguments so it can run in a worker process.
+    Raises MediaRejected for files that fail validation.
+    """
+    if kind in {"png", "jpg", "webp"}:
+        _save_reencoded_image(src_path, dest_path, kind)
+
+    elif kind == "gif":
+        if not validate_gif_limits(src_path):
+            raise MediaRejected("gif exceeds frame or pixel limits")
+        shutil.copyfile(src_path, dest_path)
+
+    # video, stored normally
+    else:
+        shutil.copyfile(src_path, dest_path)
+
+    size = os.path.getsize(dest_path)
+    if size > max_bytes:
+        os.remove(dest_path)
+        raise MediaRejected("file too large")
+
+    return size
+
+def make_variants(path: str, kind: str, widths) -> list[dict]:
+    """
+    Writes WEBP renditions of a stored media file for srcset:
+      images  -> 'thumb' at every width in `widths` narrower than the original
+      gif     -> 'poster' (first frame) at those widths, or at its own width if it is smaller
+      video   -> 'poster' the same way, from a frame grabbed with ffmpeg when it is installed
+    Returns [{"role", "width", "height", "file_path"}] with file_path relative to the folder of `path`.
+    """
+    folder = os.path.dirname(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    if kind in {"png", "jpg", "webp"}:
+        role = "thumb"
+        frame = Image.open(path)
+    elif kind == "gif":
+        role = "poster"
+        frame = Image.open(path)
+        frame.seek(0)
+    else:
+        role = "poster"
+        frame = _video_frame(path)
+        if frame is None:
+            return []
+
+    with frame:
+        frame = frame.convert("RGBA" if frame.mode in ("RGBA", "LA", "P") else "RGB")
+        targets = [w for w in sorted(widths) if w < frame.width]
+        if role == "poster" and not targets:
+            targets = [frame.width]
+
+        variants = []
+        for width in targets:
+            height = max(1, round(frame.height * width / frame.width))
+            name = f"{stem}_{role}{width}.webp"
+            frame.resize((width, height), Image.Resampling.LANCZOS).save(
+                os.path.join(folder, name), format="WEBP", quality=80, method=4
+            )
+            variants.append({"role": role, "width": width, "height": height, "file_path": name})
+    return variants
+
+def _video_frame(path: str):
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "frame.png")
+        try:
+            subprocess.run(
+                [ffmpeg, "-nostdin", "-loglevel", "error", "-ss", "0", "-i", path, "-frames:v", "1", out],
+                check=True, timeout=30,
+            )
+            frame = Image.open(out)
+            frame.load()
+            return frame
+        except (subprocess.SubprocessError, OSError):
+            return None
+
+def _save_reencoded_image(src_path: str, dest_path: str, kind: str):
     # prevent decompression bomb
     Image.MAX_IMAGE_PIXELS = 20_000_000  # tune (e.g. 20MP)
 
-    img = Image.open(file_storage.stream)
-    img.verify()  # validates structure
-    file_storage.stream.seek(0)
+    try:
+        with Image.open(src_path) as img:
+            img.verify()  # validates structure
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise MediaRejected(f"invalid image: {e}")
 
-    img = Image.open(file_storage.stream)
+    # verify() does not decode the pixels: a truncated or corrupt file only fails here.
+    # load() decodes everything up front, so an OSError from save() below is the disk's
+    # and stays a retryable job error.
+    try:
+        img = Image.open(src_path)
+        img.load()
 
-    # normalize orientation then drop metadata by re-encoding
-    img = ImageOps.exif_transpose(img)
+        # normalize orientation then drop metadata by re-encoding
+        img = ImageOps.exif_transpose(img)
 
-    # convert to a safe mode
-    if img.mode not in ("RGB", "RGBA"):
-        img = img.convert("RGB")
+        # convert to a safe mode
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
 
-    # max dimensions
-    max_side = 4000
-    if max(img.size) > max_side:
-        img.thumbnail((max_side, max_side))
+        # max dimensions
+        max_side = 4000
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side))
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise MediaRejected(f"invalid image: {e}")
 
     # save without EXIF/metadata
-    save_kwargs = {}
     if kind == "jpg":
         if img.mode == "RGBA":
             img = img.convert("RGB")
-        save_kwargs = {"quality": 85, "optimize": True}
-        img.save(abs_path, format="JPEG", **save_kwargs)
+        img.save(dest_path, format="JPEG", quality=85, optimize=True)
     elif kind == "png":
-        img.save(abs_path, format="PNG", optimize=True)
+        img.save(dest_path, format="PNG", optimize=True)
     elif kind == "webp":
-        img.save(abs_path, format="WEBP", quality=85, method=6)
+        img.save(dest_path, format="WEBP", quality=85, method=6)
     else:
-        return None
+        raise MediaRejected(f"unsupported image kind {kind}")
 
-    size = os.path.getsize(abs_path)
+def validate_gif_limits(path: str, max_pixels=20_000_000, max_frames=300):
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with Image.open(path) as img:
+            img.verify()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        return False
+
+    with Image.open(path) as img:
+        if img.format != "GIF":
+            return False
+
+        # frame count check
+        frames = 0
+        try:
+            while True:
+                img.seek(frames)
+                frames += 1
+                if frames > max_frames:
+                    return False
+        except EOFError:
+            pass
+
+    return True
+
+
+def _save_variants(cur, post_id, variants):
+    # media changed: cached feed cards for this post are stale
+    cur.execute("UPDATE posts SET card_version = card_version + 1 WHERE id = %s", (post_id,))
+    cur.executemany("""
+        INSERT INTO post_media_variants (post_id, role, width, height, file_path)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (post_id, role, width) DO UPDATE
+        SET height = EXCLUDED.height, file_path = EXCLUDED.file_path
+    """, [(post_id, v["role"], v["width"], v["height"], v["file_path"]) for v in variants])
+
+
+def _link_blob(cur, post_id, sha256):
+    """
+    Points the post's media at an existing blob; returns False when the blob is gone
+    (removed by gc-media), in which case the caller processes the upload itself.
+    """
+    # the lock keeps gc-media from deleting the blob until this transaction commits;
+    # by then trg_post_media_blob_refs has raised its ref_count
+    cur.execute("SELECT 1 FROM media_blobs WHERE sha256 = %s FOR KEY SHARE", (sha256,))
+    if cur.fetchone() is None:
+        return False
+
+    # post_media.blob_sha256 drives media_blobs.ref_count through trg_post_media_blob_refs
+    cur.execute("""
+        UPDATE post_media pm
+        SET status = 'ready',
+            blob_sha256 = b.sha256,
+            file_path = b.file_path,
+            file_size_bytes = b.file_size_bytes
+        FROM media_blobs b
+        WHERE b.sha256 = %s AND pm.post_id = %s
+        RETURNING b.variants
+    """, (sha256, post_id))
+    row = cur.fetchone()
+    if row:
+        _save_variants(cur, post_id, row[0])
+    return row is not None
+
+
+# process_media job: payload is {"post_id", "src", "upload_dir", "kind", "source_sha256", "max_bytes", "widths"};
+# source_sha256 is null for resumable uploads, whose source is hashed here in the worker
+#
+# Stored media is content-addressed: the re-encoded output is named after its sha256, so
+# identical media is kept once however many posts use it. media_source_hashes maps raw
+# upload hashes to blobs, which lets store_post_media skip this job for a repeated upload.
+
+def _run_process_media(payload):
+    upload_dir = payload["upload_dir"]
+    kind = payload["kind"]
+    source_sha = payload["source_sha256"] or sha256_file(payload["src"])
+    tmp_path = os.path.join(upload_dir, f".tmp-{secrets.token_hex(8)}.{kind}")
+    try:
+        size = process_media(payload["src"], tmp_path, kind, payload["max_bytes"])
+        sha = sha256_file(tmp_path)
+        name = f"{sha}.{kind}"
+        path = os.path.join(upload_dir, name)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # the quarantined source stays until _finish_process_media commits, so a retry can redo this
     return {
-        "file_path": abs_path,
-        "kind": kind,
-        "media_type": "image",
-        "original_filename": original,
+        "source_sha256": source_sha,
+        "sha256": sha,
+        "file_path": name,
         "file_size_bytes": size,
+        "variants": make_variants(path, kind, payload.get("widths", ())),
     }
 
-def validate_gif_limits(file_storage, max_pixels=20_000_000, max_frames=300):
-    Image.MAX_IMAGE_PIXELS = max_pixels
-    file_storage.stream.seek(0)
-    img = Image.open(file_storage.stream)
-    img.verify()
-    file_storage.stream.seek(0)
+def _finish_process_media(cur, payload, result):
+    cur.execute("""
+        INSERT INTO media_blobs (sha256, file_path, file_size_bytes, variants)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (sha256) DO UPDATE SET variants = EXCLUDED.variants
+    """, (result["sha256"], result["file_path"], result["file_size_bytes"], json.dumps(result["variants"])))
+    cur.execute("""
+        INSERT INTO media_source_hashes (source_sha256, blob_sha256)
+        VALUES (%s, %s)
+        ON CONFLICT (source_sha256) DO NOTHING
+    """, (result["source_sha256"], result["sha256"]))
+    _link_blob(cur, payload["post_id"], result["sha256"])
 
-    img = Image.open(file_storage.stream)
-    if img.format != "GIF":
-        return False
+    src = payload["src"]
+    call_after_commit(lambda: os.path.exists(src) and os.remove(src))
 
-    # frame count check
-    frames = 0
-    try:
-        while True:
-            img.seek(frames)
-            frames += 1
-            if frames > max_frames:
-                return False
-    except EOFError:
-        pass
+def _fail_process_media(cur, payload, error):
+    cur.execute("UPDATE post_media SET status = 'failed' WHERE post_id = %s", (payload["post_id"],))
+    cur.execute("UPDATE posts SET card_version = card_version + 1 WHERE id = %s", (payload["post_id"],))
+    if os.path.exists(payload["src"]):
+        os.remove(payload["src"])
 
-    return True
+register_job("process_media", _run_process_media, _finish_process_media, _fail_process_media)
+
+
+# media_variants job (backfill for media stored before derivatives existed):
+# payload is {"post_id", "path", "kind", "widths"}
+
+def _run_media_variants(payload):
+    return make_variants(payload["path"], payload["kind"], payload["widths"])
+
+def _finish_media_variants(cur, payload, variants):
+    _save_variants(cur, payload["post_id"], variants)
+
+register_job("media_variants", _run_media_variants, _finish_media_variants)
+
+def store_post_media(cur, post_id: int, media_info: dict):
+    """
+    Attaches a quarantined upload to a post. A source file that was processed before is
+    linked to its existing blob straight away; anything new, or not hashed yet (resumable
+    uploads), gets a process_media job.
+    """
+    cur.execute("""
+        INSERT INTO post_media (post_id, media_type, file_path, original_filename, mime_type, file_size_bytes, status)
+        VALUES (%s, %s, %s, %s, %s, %s, 'processing')
+    """, (
+        post_id,
+        media_info["media_type"],
+        media_info["file_path"],
+        media_info["original_filename"],
+        None,
+        media_info["file_size_bytes"]
+    ))
+
+    if media_info["source_sha256"]:
+        cur.execute("SELECT blob_sha256 FROM media_source_hashes WHERE source_sha256 = %s",
+                    (media_info["source_sha256"],))
+        row = cur.fetchone()
+        if row and _link_blob(cur, post_id, row[0]):
+            src = media_info["quarantine_path"]
+            call_after_commit(lambda: os.path.exists(src) and os.remove(src))
+            return
+
+    enqueue_job("process_media", {
+        "post_id": post_id,
+        "src": media_info["quarantine_path"],
+        "upload_dir": os.path.abspath(current_app.config["UPLOAD_FOLDER"]),
+        "kind": media_info["kind"],
+        "source_sha256": media_info["source_sha256"],
+        "max_bytes": _max_bytes_for(current_app.config, media_info["kind"]),
+        "widths": current_app.config["MEDIA_VARIANT_WIDTHS"],
+    })
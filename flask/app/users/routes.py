@@ -2,18 +2,19 @@ from flask import Blueprint
 from flask import render_template, request, redirect, url_for, session, abort, jsonify
 from flask import current_app, send_file
 from app.decorators import roles_required, login_required, permission_required
-from app.db import get_db_connection
-from app.uploads import save_upload_hardened
+from app.db import get_db
 from app.security import user_has_permission, parse_keywords
 import os
-from app.post_helpers import get_votes, get_keywords
+from app.post_helpers import get_votes, get_keywords, get_activity, get_media_variants, get_user_posts, decode_cursor, feed_page_json
 
 users_bp = Blueprint("users", __name__)
 
-@users_bp.get("/users/<int:user_id>")
-def user_profile(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def _load_profile(user_id: int):
+    """
+    Returns (profile_user, can_see_deleted, can_ban); 404s for unknown users
+    and for banned users the viewer may not moderate.
+    """
+    cur = get_db().cursor()
 
     cur.execute("""
         SELECT id, username, is_blocked, role
@@ -31,41 +32,47 @@ def user_profile(user_id: int):
 
     can_see_deleted = (current_user is not None and current_user == user_id) or user_has_permission(current_user, "delete_any_post") or role == "admin"
 
-    cur.execute("""
-        SELECT p.id, p.title, p.created_at, u.username,
-                pm.media_type, pm.file_path, p.user_id, p.is_deleted
-        FROM posts p
-        JOIN users u ON u.id = p.user_id
-        LEFT JOIN post_media pm ON pm.post_id = p.id
-        WHERE p.user_id = %s
-            AND (p.is_deleted = FALSE OR %s = TRUE)
-        ORDER BY p.created_at DESC
-        LIMIT 50
-        """, (user_id, can_see_deleted))
-
-    posts = cur.fetchall()
-
-    post_ids = [p[0] for p in posts]
-    keywords_by_post = get_keywords(post_ids)
-    
-    vote_by_post = get_votes(post_ids)
+    cur.close()
 
     can_ban = (user_has_permission(current_user, "ban_user") and profile_user[3] != "admin") or role == "admin"
 
     is_banned =  profile_user[2]
 
-    cur.close()
-    conn.close()
-
     if is_banned and not can_ban:
         abort(404)
 
+    return profile_user, can_see_deleted, can_ban
+
+@users_bp.get("/users/<int:user_id>")
+def user_profile(user_id: int):
+    profile_user, can_see_deleted, can_ban = _load_profile(user_id)
+    is_banned = profile_user[2]
+
+    posts, next_cursor = get_user_posts(user_id, can_see_deleted, decode_cursor(request.args.get("after")))
+
+    post_ids = [p[0] for p in posts]
+    keywords_by_post = get_keywords(post_ids)
+    
+    vote_by_post = get_votes(post_ids)
+
     return render_template(
         "user_profile.html",
         profile_user=profile_user,
         posts=posts,
         keywords_by_post=keywords_by_post,
         vote_by_post=vote_by_post,
+        activity_by_post=get_activity(post_ids),
+        variants_by_post=get_media_variants(post_ids),
         can_ban=can_ban,
         is_banned=is_banned,
+        next_url=url_for("users.user_profile", user_id=user_id, after=next_cursor) if next_cursor else None,
+        more_url=url_for("users.user_posts_json", user_id=user_id, after=next_cursor) if next_cursor else None,
     )
+
+@users_bp.get("/users/<int:user_id>/posts.json")
+def user_posts_json(user_id: int):
+    _profile_user, can_see_deleted, _can_ban = _load_profile(user_id)
+
+    posts, next_cursor = get_user_posts(user_id, can_see_deleted, decode_cursor(request.args.get("after")))
+    next_url = url_for("users.user_posts_json", user_id=user_id, after=next_cursor) if next_cursor else None
+    return feed_page_json(posts, next_url)